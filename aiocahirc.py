@@ -0,0 +1,86 @@
+# vi: set ai wm=0 ts=4 sw=4 et:
+""" asyncio transport for the CAH bot.  it offers the same say(),
+on_pubmsg() and game hosting surface as cahirc.Cahirc, but runs on an
+asyncio event loop, so slow work can be handed to a thread pool with
+offload() instead of stalling every channel's message handling. """
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import irc.client
+import irc.client_aio
+from config import Config
+from cahirc import CahircBase
+
+logger = logging.getLogger(__name__)
+
+class AioCahirc(CahircBase, irc.client_aio.AioSimpleIRCClient):
+    # seconds to wait before reconnecting after losing the server
+    reconnect_delay = 30
+
+    def __init__(self, game=None, loop=None):
+        config = Config().data
+        self.loop = loop or asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        super().__init__()
+        self.server = config['server']
+        self.port = config['port'] if 'port' in config else 6667
+        self.nickname = config['my_nick']
+        self.executor = ThreadPoolExecutor(max_workers=2,
+                                           thread_name_prefix='cahirc')
+        self.setup(config, game)
+
+    def start(self):
+        """ connect and run the event loop; like Cahirc.start, this never
+        returns while the bot is running """
+        if not self.started:
+            logger.info('Starting asyncio IRC subsystem')
+            self.started = True
+            self.reconnect()
+            self.tick()
+            self.reactor.process_forever()
+            logger.info('IRC stopped')
+
+    def reconnect(self):
+        try:
+            self.connect(self.server, self.port, self.nickname)
+        except (irc.client.ServerConnectionError, OSError) as err:
+            logger.info('Unable to connect to {}: {}'.format(self.server,
+                                                             err))
+            self.call_later(self.reconnect_delay, self.reconnect)
+
+    def connect(self, *args, **kwargs):
+        """ AioSimpleIRCClient.connect runs the loop until connected,
+        which can't be done from inside the running loop on reconnect """
+        if self.reactor.loop.is_running():
+            task = self.reactor.loop.create_task(
+                self.connection.connect(*args, **kwargs))
+            task.add_done_callback(self.connect_done)
+        else:
+            super().connect(*args, **kwargs)
+
+    def connect_done(self, task):
+        if task.exception() is not None:
+            logger.info('Unable to connect to {}: {}'.format(
+                        self.server, task.exception()))
+            self.call_later(self.reconnect_delay, self.reconnect)
+
+    def on_disconnect(self, connection, event):
+        if self.started:
+            logger.info('Disconnected, reconnecting in {} sec'.format(
+                        self.reconnect_delay))
+            self.call_later(self.reconnect_delay, self.reconnect)
+
+    def die(self, msg='Bye, cruel world!'):
+        self.started = False
+        self.connection.disconnect(msg)
+        self.executor.shutdown(wait=False)
+        self.reactor.loop.stop()
+
+    def call_later(self, delay, func):
+        self.reactor.loop.call_later(delay, func)
+
+    def offload(self, func, *args):
+        """ run func in a worker thread, returning an asyncio future for
+        its result """
+        return self.reactor.loop.run_in_executor(self.executor, func, *args)
@@ -0,0 +1,124 @@
+# vi: set expandtab ai:
+"""
+logging for the bot that never waits on the disk.  log calls only put
+the record on a bounded queue; a listener thread formats it and writes
+it to the log file.  when the queue backs up, debug and info records
+are sampled, and any record that doesn't fit is dropped and counted,
+so a flood of messages slows down the log rather than the game.
+"""
+
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s: %(message)s'
+
+# arguments of these types can't change before the listener formats them
+IMMUTABLE = (str, int, float, bool, bytes, type(None))
+
+_listener = None
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """ a QueueHandler that drops records instead of blocking.  once the
+    queue is high_water full, only one in sample_rate records below
+    WARNING is kept. """
+
+    def __init__(self, logqueue, sample_rate=10, high_water=0.75):
+        super().__init__(logqueue)
+        self.sample_rate = sample_rate
+        if logqueue.maxsize > 0:
+            self.high_water = int(logqueue.maxsize * high_water)
+        else:
+            self.high_water = float('inf')
+        self.sampled = 0
+        self.dropped = 0
+
+    def prepare(self, record):
+        # the listener formats the record, off the caller's thread
+        return record
+
+    def freeze(self, record):
+        """ fill in the message now if any argument could change before
+        the listener gets to it, so the log shows the argument as it was
+        when the call was made """
+        args = record.args
+        if not args:
+            return
+        values = args.values() if isinstance(args, dict) else args
+        if not all(isinstance(value, IMMUTABLE) for value in values):
+            record.msg = record.getMessage()
+            record.args = None
+
+    def enqueue(self, record):
+        backlog = self.queue.qsize()
+        if backlog >= self.high_water and record.levelno < logging.WARNING:
+            self.sampled += 1
+            if self.sampled % self.sample_rate:
+                self.dropped += 1
+                return
+        self.freeze(record)
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self.dropped and backlog < self.high_water:
+            self.report_dropped()
+
+    def report_dropped(self):
+        record = logging.LogRecord(__name__, logging.WARNING, __file__, 0,
+                                   'Dropped %d log records', (self.dropped,),
+                                   None)
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            return
+        self.dropped = 0
+
+
+class JsonFormatter(logging.Formatter):
+    """ one JSON object per line """
+
+    def format(self, record):
+        entry = {'time': record.created, 'level': record.levelname,
+                 'logger': record.name, 'message': record.getMessage()}
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def file_handler(config):
+    """ the handler writing to logfile, rotated if log_max_bytes is set """
+    filename = config['logfile']
+    max_bytes = config.get('log_max_bytes')
+    if max_bytes:
+        handler = logging.handlers.RotatingFileHandler(
+            filename, maxBytes=max_bytes,
+            backupCount=config.get('log_backups', 5))
+    else:
+        handler = logging.FileHandler(filename)
+    if config.get('log_format', 'text') == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    return handler
+
+
+def setup(config, level=logging.INFO):
+    """ send every log record through a queue to the log file.  calling
+    this again only changes the level. """
+    global _listener
+    root = logging.getLogger()
+    root.setLevel(level)
+    if _listener is not None:
+        return _listener
+    logqueue = queue.Queue(config.get('log_queue_size', 10000))
+    root.addHandler(DroppingQueueHandler(logqueue))
+    _listener = logging.handlers.QueueListener(logqueue, file_handler(config),
+                                               respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
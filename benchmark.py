@@ -0,0 +1,131 @@
+# vi: set expandtab ai:
+"""
+plays thousands of complete games between random bot players on a
+headless connection, and reports rounds per second and the latency of
+each command, to catch performance regressions in play, winner and
+announce_answers.
+
+    python benchmark.py [--games N] [--players N] [--seed N] [--allocations]
+
+--allocations also traces memory, reporting the most memory allocated
+while running each command; tracing slows everything down, so don't
+compare its latencies with an untraced run.
+"""
+
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+from collections import defaultdict
+from irc.client import Event, NickMask
+from cahirc import HeadlessIRC
+from exceptions import NoMoreCards
+from game import Game
+
+
+class Simulation(object):
+    def __init__(self, games=1000, players=4, seed=None, allocations=False):
+        self.games = games
+        self.players = players
+        self.random = random.Random(seed)
+        self.allocations = allocations
+        self.bot = HeadlessIRC(keep=False)
+        self.latency = defaultdict(list) # command -> ns per call
+        self.allocated = defaultdict(list) # command -> peak bytes per call
+        self.rounds = 0
+        self.elapsed = 0
+
+    def say(self, game, nick, text):
+        """ nick says text in game's channel, timed by command """
+        event = Event('pubmsg', NickMask('{0}!~{0}@sim'.format(nick)),
+                      game.channel, [text])
+        command = text.split()[0]
+        if self.allocations:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter_ns()
+        self.bot.on_pubmsg(None, event)
+        self.latency[command].append(time.perf_counter_ns() - start)
+        if self.allocations:
+            self.allocated[command].append(
+                tracemalloc.get_traced_memory()[1] - before)
+
+    def play_game(self, game):
+        nicks = ['bot{}'.format(i) for i in range(self.players)]
+        self.say(game, nicks[0], 'start')
+        for nick in nicks[1:]:
+            self.say(game, nick, 'join')
+        if game.status == 'wait_players':
+            raise ValueError('{} players are not enough to start a '
+                             'game'.format(self.players))
+        try:
+            while game.status != 'inactive':
+                czar = game.czar
+                pick = game.question.pick
+                for player in game.players:
+                    if player is czar:
+                        continue
+                    hand = len(player.deck)
+                    cards = self.random.sample(range(min(hand, 10)), pick)
+                    self.say(game, player.nick,
+                             'play ' + ' '.join(str(i) for i in cards))
+                self.say(game, czar.nick, 'winner {}'.format(
+                         self.random.randrange(len(game.answers))))
+                self.rounds += 1
+                self.bot.timers.advance()
+        except NoMoreCards:
+            game.end_game()
+
+    def run(self):
+        game = Game('#benchmark', self.bot)
+        if self.allocations:
+            tracemalloc.start()
+        start = time.perf_counter()
+        for i in range(self.games):
+            self.play_game(game)
+        self.elapsed = time.perf_counter() - start
+        if self.allocations:
+            tracemalloc.stop()
+        return self
+
+    def report(self, out=sys.stdout):
+        out.write('{} games, {} rounds in {:.2f} sec: {:.0f} rounds/sec, '
+                  '{} lines sent\n'.format(self.games, self.rounds,
+                  self.elapsed, self.rounds / self.elapsed, self.bot.lines))
+        header = '{:<8} {:>8} {:>10} {:>10} {:>10}'
+        columns = ['command', 'calls', 'p50 us', 'p99 us', 'max us']
+        if self.allocations:
+            header += ' {:>10}'
+            columns.append('peak KiB')
+        out.write(header.format(*columns) + '\n')
+        for command, times in sorted(self.latency.items()):
+            times = sorted(times)
+            row = [command, len(times), percentile(times, 50) / 1000,
+                   percentile(times, 99) / 1000, times[-1] / 1000]
+            line = '{:<8} {:>8} {:>10.1f} {:>10.1f} {:>10.1f}'
+            if self.allocations:
+                line += ' {:>10.1f}'
+                row.append(max(self.allocated[command]) / 1024)
+            out.write(line.format(*row) + '\n')
+
+
+def percentile(ordered, pct):
+    """ the pct'th percentile of an already sorted list """
+    index = min(len(ordered) - 1, int(len(ordered) * pct / 100))
+    return ordered[index]
+
+
+def main(argv=None):
+    args = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    args.add_argument('--games', type=int, default=1000)
+    args.add_argument('--players', type=int, default=4)
+    args.add_argument('--seed', type=int, default=None)
+    args.add_argument('--allocations', action='store_true')
+    opts = args.parse_args(argv)
+    Simulation(opts.games, opts.players, opts.seed,
+               opts.allocations).run().report()
+
+
+if __name__ == '__main__':
+    main()
@@ -5,39 +5,66 @@ import logging
 import irc.bot
 import irc.strings
 from irc.client import Event, NickMask
+from irc.dict import IRCDict
+from irc.client import is_channel
 from config import Config
 from player import Player
+from sendqueue import SendQueue, CHANNEL, PRIVATE
+from timers import TimerWheel
 from pycardbot import receive_msg
-import cmdparser as p
-from util import logtime
+import metrics
 
 logger = logging.getLogger(__name__)
 
-class Cahirc(irc.bot.SingleServerIRCBot):
-    def __init__(self, game):
-        config = Config().data
+class CahircBase(object):
+    """ the CAH side of an IRC connection, shared by every transport: a
+    registry of the games hosted on the connection, routing of incoming
+    messages to them, the rate limited send queue and the timer wheel
+    their round deadlines run on.  a transport subclass provides
+    connection, start(), die() and call_later(). """
+    def setup(self, config, game=None):
         self.game = game
-        self.parser = p.CmdParser(game)
-        port = config['port'] if 'port' in config else 6667
-        nickname = config['my_nick']
-        server = config['server']
-        port = config['port']
-        super().__init__([(server, port)], nickname, nickname)
         self.channel = config['default_channel']
         self.destination = self.channel
         self.started = False
+        self.games = IRCDict() # channel name -> Game
+        self.queue = SendQueue(config.get('send_rate', 1),
+                               config.get('send_burst', 5))
+        self.flush_pending = False
+        self.timers = TimerWheel(config.get('timer_resolution', 1))
+        if game is not None:
+            self.games[self.channel] = game
+
+    def add_game(self, channel, game):
+        """ host game in channel, returning the object the game should
+        use to talk to IRC """
+        self.games[channel] = game
+        if self.game is None:
+            self.game = game
+        if self.started:
+            self.connection.join(channel)
+        return ChannelIRC(self, channel)
+
+    def find_game(self, event):
+        """ the Game an incoming message belongs to: the channel's game
+        for public messages, and for private messages the game the sender
+        is playing in, or else the default game """
+        if event.type == 'pubmsg':
+            return self.games.get(event.target)
+        for game in self.games.values():
+            if game.get_player(event.source.nick) is not None:
+                return game
+        return self.game
+
+    def offload(self, func, *args):
+        """ run a slow function without holding up message handling, if
+        the transport is able to.  the blocking transport just calls it. """
+        return func(*args)
 
     #------------------------------------------------------------
     # IRC bot functions
     #------------------------------------------------------------
 
-    def start(self):
-        if not self.started:
-            logger.info('Starting IRC subsystem')
-            self.started = True
-            super().start()
-            logger.info('IRC started')
-
     def on_nicknameinuse(self, connection, event):
         nick = connection.get_nickname()
         newnick = nick + '_'
@@ -46,25 +73,141 @@ class Cahirc(irc.bot.SingleServerIRCBot):
         connection.nick(newnick)
 
     def on_welcome(self, connection, event):
-        logger.info('Joining {}'.format(self.channel))
-        connection.join(self.channel)
-        self.say(self.game.get_text('game_start'))
+        for channel, game in self.games.items():
+            logger.info('Joining {}'.format(channel))
+            connection.join(channel)
+            game.irc.destination = game.irc.channel
+            game.irc.say(game.greeting())
 
     def on_privmsg(self, connection, event):
-        receive_msg(self.game, IRCmsg(event))
+        game = self.find_game(event)
+        if game is not None:
+            receive_msg(game, IRCmsg(event))
 
     def on_pubmsg(self, connection, event):
-        receive_msg(self.game, IRCmsg(event))
+        game = self.find_game(event)
+        if game is not None:
+            receive_msg(game, IRCmsg(event))
 
     #------------------------------------------------------------
     # CAH specific functions
     #------------------------------------------------------------
 
-    @logtime
+    @metrics.timed
+    def say(self, text):
+        """ recipient is either the channel name, or the nick for a privmsg """
+        self.send(self.destination, text)
+
+    def send(self, destination, text):
+        """ queue text for destination, one line per line of text, and
+        send whatever the rate limit allows right away """
+        priority = CHANNEL if is_channel(destination) else PRIVATE
+        for line in text.split('\n'):
+            self.queue.put(destination, line, priority)
+        self.flush()
+
+    def flush(self):
+        """ send queued lines until the queue is empty or the rate limit
+        is reached, in which case try again once it has refilled """
+        self.flush_pending = False
+        message = self.queue.get()
+        while message is not None:
+            self.send_line(*message)
+            message = self.queue.get()
+        metrics.SEND_QUEUE.set(len(self.queue))
+        if len(self.queue) and not self.flush_pending:
+            self.flush_pending = True
+            self.call_later(self.queue.delay(), self.flush)
+
+    def send_line(self, destination, text):
+        logger.debug('Sending to %s: %s', destination, text)
+        self.connection.privmsg(destination, text)
+        metrics.MESSAGES_OUT.inc()
+
+    def tick(self):
+        """ fire due timers, and come back next tick """
+        self.timers.advance()
+        self.call_later(self.timers.resolution, self.tick)
+
+    def shutdown(self, message):
+        """ say goodbye in every channel and disconnect.  whatever is
+        still queued is sent straight away, since there's no waiting for
+        the rate limit to refill once we're leaving. """
+        for channel in self.games:
+            self.send(channel, message)
+        for destination, text in self.queue.drain():
+            self.send_line(destination, text)
+        metrics.SEND_QUEUE.set(0)
+        self.die('Shutting down')
+
+
+class Cahirc(CahircBase, irc.bot.SingleServerIRCBot):
+    """ one IRC connection, which may host a game in any number of
+    channels.  a Game built without a bot makes its own Cahirc and is
+    registered for the default channel.  this transport runs the irc
+    library's blocking reactor; see aiocahirc for the asyncio one. """
+    def __init__(self, game=None):
+        config = Config().data
+        port = config['port'] if 'port' in config else 6667
+        nickname = config['my_nick']
+        server = config['server']
+        port = config['port']
+        super().__init__([(server, port)], nickname, nickname)
+        self.setup(config, game)
+
+    def start(self):
+        if not self.started:
+            logger.info('Starting IRC subsystem')
+            self.started = True
+            self.tick()
+            super().start()
+            logger.info('IRC started')
+
+    def call_later(self, delay, func):
+        self.reactor.scheduler.execute_after(delay, func)
+
+
+class HeadlessIRC(CahircBase):
+    """ a connection to nowhere, for simulations and benchmarks.  games
+    hosted on it run exactly as they would on IRC, but what they say is
+    kept in sent (or, with keep=False, only counted) instead of going to
+    a server.  nothing is ever scheduled, so advance timers by hand. """
+    def __init__(self, game=None, keep=True):
+        self.setup(Config().data, game)
+        self.sent = [] if keep else None
+        self.lines = 0
+
+    def start(self):
+        pass
+
+    def die(self, msg=''):
+        pass
+
+    def send(self, destination, text):
+        for line in text.split('\n'):
+            self.lines += 1
+            metrics.MESSAGES_OUT.inc()
+            if self.sent is not None:
+                self.sent.append((destination, line))
+
+    def call_later(self, delay, func):
+        pass
+
+
+class ChannelIRC(object):
+    """ a game's view of a shared Cahirc connection.  it has the same
+    channel, destination and say() interface as Cahirc, so a Game does
+    not need to know whether it owns the connection. """
+    def __init__(self, bot, channel):
+        self.bot = bot
+        self.channel = channel
+        self.destination = channel
+        self.timers = bot.timers
+
+    @metrics.timed
     def say(self, text):
         """ recipient is either the channel name, or the nick for a privmsg """
-        logger.debug('Sending to {}: {}'.format(self.destination, text))
-        self.connection.privmsg(self.destination, text)
+        self.bot.send(self.destination, text)
 
 
 class IRCmsg(object):
@@ -74,8 +217,7 @@ class IRCmsg(object):
         self.user = event.source.user
         self.msg = event.arguments[0]
         self.source = event.type
-        logger.debug('Got {} from {}: {}'.format(self.source, self.nick, 
-                                                 self.msg))
+        logger.debug('Got %s from %s: %s', self.source, self.nick, self.msg)
 
     def make_player(self):
         return Player(self.nick, self.user)
@@ -1,14 +1,43 @@
 # vi: set et ai sm:
 
-import re
+import sys
+
+
+def kept(value):
+    """ whether a card file's 'keep' value leaves the card in play;
+    anything but No (or false) keeps it """
+    return str(value).lower() not in ('no', 'false', '0')
+
 
 class Card(object):
-    def __init__(self, cardtype, value):
-        self.cardtype = cardtype
-        self.value = value
-        self.draw = 0
-        self.pick = 1
-        self.source = 'unknown'
+    """ a single card.  cards are immutable once made, since the same
+    Card is shared by every game dealing from a CardPool.  the type and
+    source strings are interned, so each pack stores them only once. """
+
+    __slots__ = ('cardtype', 'value', 'draw', 'pick', 'source', 'id',
+                 'segments', 'blanks', 'formattedvalue')
+
+    def __init__(self, cardtype, value, pick=1, draw=0, source='unknown',
+                 cardid=None):
+        init = object.__setattr__
+        init(self, 'cardtype', sys.intern(cardtype))
+        init(self, 'value', value)
+        init(self, 'draw', draw)
+        init(self, 'pick', pick)
+        init(self, 'source', sys.intern(source))
+        init(self, 'id', cardid) # index in the CardPool, if it came from one
+        # the text around each %s blank is split out once here, so
+        # filling in answers is just a join
+        segments = tuple(value.split('%s'))
+        init(self, 'segments', segments)
+        init(self, 'blanks', len(segments) - 1)
+        init(self, 'formattedvalue', '___'.join(segments))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Card objects are immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('Card objects are immutable')
 
     def __repr__(self):
         return self.info()
@@ -17,6 +46,7 @@ class Card(object):
         return '[{}] {}: {} (pick {} draw {})'.format(self.source,
             self.cardtype, self.value, self.pick, self.draw)
 
-    @property
-    def formattedvalue(self):
-        return re.sub('%s', '___', self.value)
+    def with_id(self, cardid):
+        """ a copy of this Card with the given pool index """
+        return Card(self.cardtype, self.value, self.pick, self.draw,
+                    self.source, cardid)
@@ -0,0 +1,218 @@
+# vi: set expandtab ai:
+"""
+a process-wide pool of every known card.  the pool is loaded once and
+never modified; each game's deck only holds integer indices into it, so
+concurrent games share one copy of the card text.
+
+the shared pool is a CorpusPool, which reads only the pack manifest and
+card types up front.  a Card is built from the corpus the first time it
+is dealt, so packs nobody plays with never cost any memory.
+
+cards whose text appears more than once in the corpus (the same card in
+a regional variant of a pack, say) are indexed when the pool is opened,
+and select() keeps only one copy of each, so a deck never holds the same
+card twice.  select() also leaves out cards the card files don't keep,
+questions that pick too many answers, and cards failing any custom
+predicate, all in one pass over the chosen packs.
+"""
+
+import os
+import hashlib
+import itertools
+import logging
+import threading
+import corpus
+
+logger = logging.getLogger(__name__)
+
+_pools = {}
+_lock = threading.Lock()
+
+
+class CardPool(object):
+    """ an immutable, indexed collection of Cards.  a card's index in
+    the pool is stored in its id attribute. """
+
+    def __init__(self, cards):
+        self.cards = tuple(card if card.id == cardid else
+                           card.with_id(cardid)
+                           for cardid, card in enumerate(cards))
+        self.answers = tuple(card.id for card in self.cards
+                             if card.cardtype == 'Answer')
+        self.questions = tuple(card.id for card in self.cards
+                               if card.cardtype == 'Question')
+        self._fingerprint = None
+
+    @property
+    def fingerprint(self):
+        """ a hash of the pool's contents, to tell whether card ids saved
+        from another run still mean the same cards """
+        if self._fingerprint is None:
+            digest = hashlib.sha1()
+            for card in self.cards:
+                digest.update('{}\0{}\0'.format(card.cardtype,
+                                                 card.value).encode('utf-8'))
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def __getitem__(self, cardid):
+        return self.cards[cardid]
+
+    def __len__(self):
+        return len(self.cards)
+
+    def cardtype(self, cardid):
+        return self.cards[cardid].cardtype
+
+
+class CorpusPool(CardPool):
+    """ a CardPool over a compiled corpus.  card ids are corpus record
+    numbers; each Card is built on first use. """
+
+    def __init__(self, corpusobj):
+        self.corpus = corpusobj
+        self.sources = corpusobj.sources()
+        self.types = corpusobj.types()
+        self.keep = corpusobj.column(corpus.KEEP)
+        self.picks = corpusobj.column(corpus.PICK)
+        self.cards = [None] * len(self.types)
+        answer = corpus.CARDTYPES.index('Answer')
+        self.answers = tuple(cardid for cardid, cardtype in
+                             enumerate(self.types)
+                             if cardtype == answer and self.keep[cardid])
+        self.questions = tuple(cardid for cardid, cardtype in
+                               enumerate(self.types)
+                               if cardtype != answer and self.keep[cardid])
+        self.packs = corpusobj.packs()
+        self.copies, self.pack_of = self.index_copies(corpusobj.hashes())
+        self.lock = threading.Lock()
+        # the files the corpus was built from identify its cards without
+        # reading them all
+        digest = hashlib.sha1()
+        for name, mtime, size, sha1, first, count in corpusobj.files():
+            digest.update(name.encode('utf-8') + b'\0' + sha1)
+        self._fingerprint = digest.hexdigest()
+
+    def __getitem__(self, cardid):
+        card = self.cards[cardid]
+        if card is None:
+            with self.lock:
+                card = self.cards[cardid]
+                if card is None:
+                    card = self.cards[cardid] = self.corpus.card(cardid,
+                                                                 self.sources)
+        return card
+
+    def cardtype(self, cardid):
+        return corpus.CARDTYPES[self.types[cardid]]
+
+    def index_copies(self, hashes):
+        """ (copies, pack_of): copies lists the ids of each card found
+        more than once, by type and text hash; pack_of maps each of those
+        ids to its pack """
+        groups = {}
+        for cardid, key in enumerate(zip(self.types, hashes)):
+            groups.setdefault(key, []).append(cardid)
+        copies = [ids for ids in groups.values() if len(ids) > 1]
+        pack_of = {}
+        for name, ranges in self.packs.items():
+            for first, count in ranges:
+                for ids in copies:
+                    pack_of.update((cardid, name) for cardid in ids
+                                   if first <= cardid < first + count)
+        return copies, pack_of
+
+    def pack_sizes(self):
+        """ dict of pack name -> number of cards, from the manifest """
+        return {name: sum(count for first, count in ranges)
+                for name, ranges in self.packs.items()}
+
+    def match_packs(self, words):
+        """ the packs named by words: a word that is a pack's whole name
+        picks that pack, otherwise it picks every pack whose name
+        contains it (ignoring case).  returns (packs, unmatched words) """
+        names = {name.lower(): name for name in self.packs}
+        packs = set()
+        unmatched = []
+        for word in words:
+            word = word.lower()
+            if word in names:
+                packs.add(names[word])
+                continue
+            found = {name for lower, name in names.items() if word in lower}
+            if not found:
+                unmatched.append(word)
+            packs |= found
+        return sorted(packs), unmatched
+
+    def pack_ids(self, packs=None):
+        """ iterate over the ids of every card in packs (by default
+        every pack) """
+        if packs is None:
+            return iter(range(len(self.types)))
+        return itertools.chain.from_iterable(
+            range(first, first + count)
+            for name in packs for first, count in self.packs[name])
+
+    def select(self, packs=None, prefer=(), max_pick=None, predicates=()):
+        """ the ids of the cards in packs (by default every pack) to play
+        with: those the card files keep, leaving out questions with a
+        pick above max_pick, cards for which any of predicates (called
+        with the Card) is false, and all but one copy of each repeated
+        card.  the cards are filtered in a single pass; predicates are
+        only called for cards that pass every other check, so only those
+        Cards are built. """
+        dropped = self.copies_dropped(self.packs if packs is None else packs,
+                                      prefer)
+        keep, types, picks = self.keep, self.types, self.picks
+        question = corpus.CARDTYPES.index('Question')
+        if max_pick is None:
+            max_pick = 255
+        return [cardid for cardid in self.pack_ids(packs)
+                if keep[cardid] and cardid not in dropped and
+                (types[cardid] != question or picks[cardid] <= max_pick) and
+                all(test(self[cardid]) for test in predicates)]
+
+    def copies_dropped(self, packs, prefer=()):
+        """ the set of ids to leave out so that packs hold one copy of
+        each repeated card.  the copy kept is from the pack matching the
+        earliest of the prefer words, as in match_packs, or else from
+        the pack whose name sorts first. """
+        prefer = [word.lower() for word in prefer or ()]
+
+        def rank(cardid):
+            name = self.pack_of[cardid]
+            lower = name.lower()
+            for i, word in enumerate(prefer):
+                if word in lower:
+                    return i, name, cardid
+            return len(prefer), name, cardid
+
+        chosen = set(packs)
+        dropped = set()
+        for ids in self.copies:
+            found = [i for i in ids
+                     if self.keep[i] and self.pack_of[i] in chosen]
+            if len(found) > 1:
+                found.sort(key=rank)
+                dropped.update(found[1:])
+        return dropped
+
+
+def get_pool(carddir, corpusfile):
+    """ return the shared CardPool for carddir, loading it on first use """
+    key = (os.path.abspath(carddir), os.path.abspath(corpusfile))
+    with _lock:
+        if key not in _pools:
+            _pools[key] = CorpusPool(corpus.open_corpus(carddir,
+                                                        corpusfile))
+            logger.info('Opened card pool of {} cards in {} packs'.format(
+                        len(_pools[key]), len(_pools[key].packs)))
+        return _pools[key]
+
+
+def reset():
+    """ forget all loaded pools, so the next game re-reads carddir.
+    decks already dealt from an old pool keep working. """
+    with _lock:
+        _pools.clear()
@@ -8,51 +8,111 @@ from player import Player
 import cahirc as irc
 
 
+# hasargs: command can take arguments
+# required: arguments are required, and a cmd without args will
+# be discarded
+# cardargs: arguments are cards
+# anon: command can be invoked even if not registered in the game
+# wordargs: arguments are words rather than numbers, and any number of
+# them may be given
+Attrs = namedtuple('Attrs', 'hasargs required cardargs anon wordargs',
+                   defaults=(False,))
+CMDATTRS = {
+             'cards': Attrs(False, False, False, False),
+             'commands': Attrs(False, False, False, True),
+             'help': Attrs(False, False, False, True),
+             'join': Attrs(False, False, False, True),
+             'list': Attrs(False, False, False, True),
+             'packs': Attrs(False, False, False, True),
+             'pick': Attrs(True, True, False, False),
+             'play': Attrs(True, True, True, False),
+             'quit': Attrs(False, False, False, False),
+             'reload': Attrs(False, False, False, True),
+             'score': Attrs(False, False, False, False),
+             'shame': Attrs(False, False, False, False),
+             'start': Attrs(True, False, False, True, True),
+             'state': Attrs(False, False, False, False),
+             'status': Attrs(False, False, False, False),
+             'top': Attrs(False, False, False, True),
+             'winner': Attrs(True, True, False, False),
+             }
+
+# order is important.  aliases will be evaluated in order.
+# 'pick' aliases to 'play' most of the time so that the play()
+# function can deal with out of bound conditions
+Cmdalias = namedtuple('Cmdalias', 'alias command state')
+ALIASES = [ Cmdalias('leave', 'quit', 'any'),
+            Cmdalias('pick', 'winner', 'wait_czar'),
+            Cmdalias('pick', 'play', 'any'),
+            Cmdalias('players', 'list', 'any'),
+            Cmdalias('shame', 'score', 'any'),
+            Cmdalias('status', 'state', 'any') ]
+
+# derived from CMDATTRS and ALIASES by compile_commands()
+COMMAND_WORDS = frozenset() # every word a command line can start with
+COMMAND_LIST = ''
+ALIAS_TABLE = {} # (alias, state) -> command
+
+# the maximum number of arguments any command can take
+MAX_ARGS = 3
+ARG_RE = re.compile(r'^\d$')
+
+
+def compile_commands() -> None:
+    """ rebuild the lookup tables derived from the command table.  call
+    this after changing CMDATTRS or ALIASES (add_alias does it). """
+    global COMMAND_WORDS, COMMAND_LIST, ALIAS_TABLE
+    table = {}
+    for alias in ALIASES:
+        # the list is evaluated in order, so an alias valid in any state
+        # hides later entries for the same word
+        if (alias.alias, 'any') not in table:
+            table.setdefault((alias.alias, alias.state), alias.command)
+    ALIAS_TABLE = table
+    COMMAND_WORDS = frozenset(CMDATTRS) | frozenset(a.alias for a in ALIASES)
+    COMMAND_LIST = ', '.join(sorted(CMDATTRS))
+
+
+def add_alias(alias, command, state='any') -> None:
+    ALIASES.append(Cmdalias(alias, command, state))
+    compile_commands()
+
+
+def resolve_alias(word, state) -> str:
+    """ the command that word means in the given game state """
+    command = ALIAS_TABLE.get((word, state))
+    if command is None:
+        command = ALIAS_TABLE.get((word, 'any'), word)
+    return command
+
+
+def might_be_command(text) -> bool:
+    """ cheap check used to ignore channel chatter before parsing: does
+    the line start with a command word? """
+    words = text.split(None, 1)
+    return bool(words) and words[0] in COMMAND_WORDS
+
+
+compile_commands()
+
+
 class CmdParser(object):
     """ this class represents the command parsing structure for the
-    game. """
+    game.  one parser is kept per game and reused for every message;
+    parse() resets the per-message state. """
+
+    cmdattrs = CMDATTRS
+    aliases = ALIASES
+    max_args = MAX_ARGS
 
     def __init__(self, game):
-        # hasargs: command can take arguments
-        # required: arguments are required, and a cmd without args will
-        # be discarded
-        # cardargs: arguments are cards
-        # anon: command can be invoked even if not registered in the game
-        Attrs = namedtuple('Attrs', 'hasargs required cardargs anon')
-        self.cmdattrs = { 
-                     'cards': Attrs(False, False, False, False),
-                     'commands': Attrs(False, False, False, True),
-                     'help': Attrs(False, False, False, True),
-                     'join': Attrs(False, False, False, True),
-                     'list': Attrs(False, False, False, True),
-                     'pick': Attrs(True, True, False, False),
-                     'play': Attrs(True, True, True, False),
-                     'quit': Attrs(False, False, False, False),
-                     'reload': Attrs(False, False, False, True),
-                     'score': Attrs(False, False, False, False),
-                     'shame': Attrs(False, False, False, False),
-                     'start': Attrs(True, False, False, True),
-                     'state': Attrs(False, False, False, False),
-                     'status': Attrs(False, False, False, False),
-                     'winner': Attrs(True, True, False, False),
-                     }
-
-        # order is important.  aliases will be evaluated in order.
-        # 'pick' aliases to 'play' most of the time so that the play()
-        # function can deal with out of bound conditions
-        Cmdalias = namedtuple('Cmdalias', 'alias command state')
-        self.aliases = [ Cmdalias('leave', 'quit', 'any'),
-                         Cmdalias('pick', 'winner', 'wait_czar'),
-                         Cmdalias('pick', 'play', 'any'),
-                         Cmdalias('players', 'list', 'any'),
-                         Cmdalias('shame', 'score', 'any'),
-                         Cmdalias('status', 'state', 'any') ]
-
-        # the maximum number of arguments any command can take
-        self.max_args = 3
         self.game = game
+        self.reset()
+
+    def reset(self):
         self.ircmsg = None
         self._string = None
+        self._alias = None
         self.player = None
         self.words = []
         self.args = []
@@ -67,23 +127,28 @@ class CmdParser(object):
         return False
 
     def get_args(self) -> None:
+        if self.cmdattrs[self.command].wordargs:
+            self.args = self.words[1:]
+            return
         for i in range(1, len(self.words)):
             if i > self.max_args:
                 return
-            if re.search('^\d$', self.words[i]):
+            if ARG_RE.search(self.words[i]):
                 self.args.append(int(self.words[i]))
 
     def get_commands(self) -> str:
-        return ', '.join(sorted(list(self.cmdattrs.keys())))
+        return COMMAND_LIST
 
     def parse(self, msg=None):
+        self.reset()
         self.set_recipient(msg)
         if msg.msg is not None:
             self.string = msg.msg
-        if not self.is_command():
+        if not self.words or not self.is_command():
             self.command = None
             return
         self.command = self.get_alias()
+        registered = False
         if self.cmdattrs[self.command]:
             self.player = self.game.get_player(msg.nick)
             registered = True
@@ -100,11 +165,11 @@ class CmdParser(object):
             self.play_cards()
 
     def get_alias(self) -> str:
-        for alias in self.aliases:
-            if self.words[0] == alias.alias and (self.game.status ==
-                alias.state or alias.state == 'any'):
-                return alias.command
-        return self.words[0]
+        """ the command the first word resolves to, looked up once per
+        message """
+        if self._alias is None:
+            self._alias = resolve_alias(self.words[0], self.game.status)
+        return self._alias
 
     def play_cards(self) -> None:
         cardargs = []
@@ -119,8 +184,9 @@ class CmdParser(object):
             cardargs.append(card)
         # "deal" the cards out to the parser
         self.args = cardargs
-        # now remove those cards from player's hand
-        for num in nums:
+        # now remove those cards from player's hand, highest first so
+        # the positions of the rest don't shift
+        for num in sorted(nums, reverse=True):
             self.player.deal(num)
 
     def set_recipient(self, msg):
@@ -143,3 +209,4 @@ class CmdParser(object):
     def string(self, info):
         self._string = info
         self.words = info.split()
+        self._alias = None
@@ -2,18 +2,53 @@
 
 import os
 import yaml
+import threading
+import templates
+
+# the C parser is much faster, when libyaml is available
+Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# filename -> (mtime_ns, size, data, text): every config file parsed so
+# far, reused until the file changes
+_cache = {}
+_lock = threading.Lock()
+
+
+def load_file(filename):
+    """ the parsed contents and compiled text strings of a config file,
+    parsed again only if the file has changed since it was last read """
+    stat = os.stat(filename)
+    with _lock:
+        cached = _cache.get(filename)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2:]
+    with open(filename, 'r') as fp:
+        data = yaml.load(fp, Loader=Loader)
+    text = templates.compile_text(data.get('text', {}))
+    with _lock:
+        _cache[filename] = (stat.st_mtime_ns, stat.st_size, data, text)
+    return data, text
+
 
 class Config(object):
-    """ instantiating this class reads in all the config files """
+    """ instantiating this class reads in all the config files.  files
+    are only parsed when they have changed, so this is cheap. """
 
     # the fields which are allowed in the config file
-    _fields = ['carddir', 'default_channel', 'my_nick', 'server', 'port',
-        'turns', 'min_players', 'max_players', 'text', 'language',
-        'hand_size', 'logfile', 'max_points']
+    _fields = ['carddir', 'corpusfile', 'default_channel', 'channels',
+        'my_nick', 'server', 'port', 'turns', 'min_players', 'max_players',
+        'text', 'language', 'hand_size', 'logfile', 'max_points',
+        'send_rate', 'send_burst', 'transport', 'statsfile',
+        'snapshotdir', 'answer_timeout', 'czar_timeout', 'max_idle',
+        'timer_resolution', 'metrics_port', 'metrics_interval',
+        'packs', 'log_format', 'log_max_bytes', 'log_backups',
+        'log_queue_size', 'prefer_packs',
+        'max_pick']
 
     def __init__(self):
         self.path = ['.', '..'] # the last config.yaml found will win
         self.data = {}
+        self.text = {} # compiled text strings, by language
         self.read_files()
 
     def fake_get(self, name):
@@ -23,16 +58,20 @@ class Config(object):
             return 'cards'
 
     def read_files(self):
+        found = None
         for path in self.path:
-            filename = '{}/config.yaml'.format(path)
+            filename = os.path.abspath('{}/config.yaml'.format(path))
             if os.path.isfile(filename):
-                with open(filename, 'r') as fp:
-                    data = yaml.load(fp.read())
-                    self.data = data
-                    self.check_config()
+                found = load_file(filename)
+                self.check_config(found[0])
+        if found is not None:
+            data, text = found
+            # the parsed file is shared; each Config gets its own copy of
+            # the top level, and both are swapped in together
+            self.data, self.text = dict(data), text
 
-    def check_config(self):
-        for name in self.data:
+    def check_config(self, data=None):
+        for name in (self.data if data is None else data):
             if name not in self._fields:
                 raise ValueError('{} is not a known config field'.format(name))
 
@@ -0,0 +1,290 @@
+# vi: set expandtab ai:
+"""
+compiles the JSON card files in carddir into a single versioned binary
+corpus, so a game can load every card with one mmap instead of parsing
+each JSON file.  the corpus is rebuilt automatically whenever a source
+file is added, removed or changed.
+
+layout (all integers little endian):
+    header      magic, version, file/source/card counts, string table size
+    files       one entry per JSON file: name, mtime, size, sha1 and the
+                range of records read from it
+    sources     one entry per distinct 'source' string
+    records     fixed width: type, pick, draw, keep, source index, value,
+                text hash
+    strings     utf-8 string table referenced by offset/length
+
+each JSON file belongs to a pack, named for the file without its _a/_q
+suffix, so OfficialBaseSet_a.json and OfficialBaseSet_q.json make up the
+OfficialBaseSet pack.  packs() reads the pack manifest from the file
+entries alone, without touching any card text.
+
+the type, pick, draw and keep of every card can be read as a column
+straight from the records (see column), without building any Cards.
+each record also carries a hash of its normalized text (see normalize),
+so cards repeated across packs can be found without reading any text.
+
+run this module directly to (re)build the corpus by hand:
+    python corpus.py [carddir] [corpusfile]
+"""
+
+import os
+import re
+import sys
+import mmap
+import json
+import struct
+import unicodedata
+import hashlib
+import logging
+from card import Card, kept
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'CAHC'
+VERSION = 3
+
+# magic, version, reserved, files, sources, cards, string table size
+HEADER = struct.Struct('<4sHHIIII')
+# name offset, name length, mtime_ns, size, sha1, first record, records
+FILEENTRY = struct.Struct('<IIqQ20sII')
+# string offset, string length
+SOURCEENTRY = struct.Struct('<II')
+# type, pick, draw, keep, source index, value offset, value length, hash
+RECORD = struct.Struct('<BBBBIIIQ')
+# byte offsets of the one byte fields in a record, for column()
+TYPE, PICK, DRAW, KEEP = range(4)
+
+CARDTYPES = ('Answer', 'Question')
+
+
+class CorpusError(Exception):
+    """ the corpus file is missing, truncated or from another version """
+
+
+def card_files(carddir):
+    """ sorted list of the JSON card files in carddir """
+    return sorted(name for name in os.listdir(carddir)
+                  if name.endswith('json'))
+
+
+def pack_name(filename):
+    """ the pack a card file belongs to """
+    name = filename[:-5] if filename.endswith('.json') else filename
+    if name[-2:] in ('_a', '_q'):
+        name = name[:-2]
+    return name
+
+
+def normalize(text):
+    """ card text reduced to lowercase words, so copies that differ only
+    in case, punctuation or spacing compare equal """
+    text = unicodedata.normalize('NFKC', text).casefold()
+    return ' '.join(re.sub(r'[\W_]+', ' ', text).split())
+
+
+def text_hash(text):
+    """ 64 bit hash of the normalized text """
+    return int.from_bytes(hashlib.blake2b(normalize(text).encode('utf-8'),
+                                          digest_size=8).digest(), 'little')
+
+
+def file_hash(filename):
+    with open(filename, 'rb') as fp:
+        return hashlib.sha1(fp.read()).digest()
+
+
+def compile_corpus(carddir, corpusfile):
+    """ read every JSON card file in carddir and write the binary corpus
+    to corpusfile.  the file is written under a temporary name and moved
+    into place, so a reader never sees a half written corpus. """
+    strings = bytearray()
+
+    def add_string(text):
+        data = text.encode('utf-8')
+        offset = len(strings)
+        strings.extend(data)
+        return offset, len(data)
+
+    files = []
+    sources = []
+    source_index = {}
+    records = []
+    for name in card_files(carddir):
+        filename = os.path.join(carddir, name)
+        stat = os.stat(filename)
+        with open(filename, 'rb') as fp:
+            raw = fp.read()
+        cards = json.loads(raw.decode('utf-8'))
+        first = len(records)
+        for tmpcard in cards:
+            source = tmpcard['source']
+            if source not in source_index:
+                source_index[source] = len(sources)
+                sources.append(add_string(source))
+            offset, length = add_string(tmpcard['value'])
+            records.append((CARDTYPES.index(tmpcard['type']),
+                            tmpcard['pick'], tmpcard['draw'],
+                            kept(tmpcard.get('keep', 'Yes')),
+                            source_index[source], offset, length,
+                            text_hash(tmpcard['value'])))
+        name_offset, name_length = add_string(name)
+        files.append((name_offset, name_length, stat.st_mtime_ns,
+                      stat.st_size, hashlib.sha1(raw).digest(), first,
+                      len(records) - first))
+
+    tmpfile = '{}.tmp{}'.format(corpusfile, os.getpid())
+    with open(tmpfile, 'wb') as fp:
+        fp.write(HEADER.pack(MAGIC, VERSION, 0, len(files), len(sources),
+                             len(records), len(strings)))
+        for entry in files:
+            fp.write(FILEENTRY.pack(*entry))
+        for entry in sources:
+            fp.write(SOURCEENTRY.pack(*entry))
+        for entry in records:
+            fp.write(RECORD.pack(*entry))
+        fp.write(strings)
+    os.replace(tmpfile, corpusfile)
+    logger.info('Compiled {} cards from {} files into {}'.format(
+                len(records), len(files), corpusfile))
+
+
+class Corpus(object):
+    """ read-only view of a compiled corpus file """
+
+    def __init__(self, corpusfile):
+        with open(corpusfile, 'rb') as fp:
+            try:
+                self.data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise CorpusError('{} is empty'.format(corpusfile))
+        if len(self.data) < HEADER.size:
+            raise CorpusError('{} is truncated'.format(corpusfile))
+        (magic, version, _, self.nfiles, self.nsources, self.ncards,
+         strlen) = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise CorpusError('{} is not a version {} corpus'.format(
+                              corpusfile, VERSION))
+        self.files_at = HEADER.size
+        self.sources_at = self.files_at + self.nfiles * FILEENTRY.size
+        self.records_at = self.sources_at + self.nsources * SOURCEENTRY.size
+        self.strings_at = self.records_at + self.ncards * RECORD.size
+        if len(self.data) != self.strings_at + strlen:
+            raise CorpusError('{} is truncated'.format(corpusfile))
+
+    def close(self):
+        self.data.close()
+
+    def string(self, offset, length):
+        start = self.strings_at + offset
+        return self.data[start:start + length].decode('utf-8')
+
+    def files(self):
+        """ list of (name, mtime_ns, size, sha1, first, count) tuples """
+        entries = []
+        for i in range(self.nfiles):
+            (offset, length, mtime, size, sha1, first,
+             count) = FILEENTRY.unpack_from(self.data,
+                                            self.files_at + i * FILEENTRY.size)
+            entries.append((self.string(offset, length), mtime, size, sha1,
+                            first, count))
+        return entries
+
+    def sources(self):
+        return [self.string(*SOURCEENTRY.unpack_from(self.data,
+                self.sources_at + i * SOURCEENTRY.size))
+                for i in range(self.nsources)]
+
+    def packs(self):
+        """ the pack manifest: a dict of pack name -> list of (first
+        record, count) ranges, one per file in the pack """
+        packs = {}
+        for name, mtime, size, sha1, first, count in self.files():
+            packs.setdefault(pack_name(name), []).append((first, count))
+        return packs
+
+    def column(self, field):
+        """ one of the one byte fields (TYPE, PICK, DRAW or KEEP) of
+        every card, as bytes.  only that byte of each record is read. """
+        return self.data[self.records_at + field:self.strings_at:RECORD.size]
+
+    def types(self):
+        """ the type of every card, as indices into CARDTYPES """
+        return self.column(TYPE)
+
+    def hashes(self):
+        """ the text hash of every card, in record order """
+        return [record[-1] for record in RECORD.iter_unpack(
+                self.data[self.records_at:self.strings_at])]
+
+    def card(self, cardid, sources):
+        """ build the Card for one record; sources is from sources() """
+        (cardtype, pick, draw, _, source, offset, length,
+         _) = RECORD.unpack_from(self.data,
+                                 self.records_at + cardid * RECORD.size)
+        return Card(CARDTYPES[cardtype], self.string(offset, length), pick,
+                    draw, sources[source], cardid)
+
+    def cards(self):
+        """ build a Card for every record in the corpus, leaving out the
+        cards the card files don't keep """
+        sources = self.sources()
+        cards = []
+        for cardid, (cardtype, pick, draw, keep, source, offset, length,
+                     _) in enumerate(RECORD.iter_unpack(
+                        self.data[self.records_at:self.strings_at])):
+            if not keep:
+                continue
+            cards.append(Card(CARDTYPES[cardtype],
+                              self.string(offset, length), pick, draw,
+                              sources[source], cardid))
+        return cards
+
+
+def is_stale(corpus, carddir):
+    """ True if the JSON files in carddir no longer match the ones the
+    corpus was compiled from.  files whose mtime and size are unchanged
+    are trusted; anything else is compared by hash. """
+    names = card_files(carddir)
+    entries = corpus.files()
+    if names != [entry[0] for entry in entries]:
+        return True
+    for name, mtime, size, sha1, first, count in entries:
+        stat = os.stat(os.path.join(carddir, name))
+        if stat.st_mtime_ns == mtime and stat.st_size == size:
+            continue
+        if stat.st_size != size or file_hash(os.path.join(carddir,
+                                                          name)) != sha1:
+            return True
+    return False
+
+
+def open_corpus(carddir, corpusfile):
+    """ return an up to date Corpus for carddir, compiling it first if
+    the corpus file is missing, unreadable or stale. """
+    try:
+        corpus = Corpus(corpusfile)
+    except (OSError, CorpusError) as err:
+        logger.info('Rebuilding card corpus: {}'.format(err))
+    else:
+        if not is_stale(corpus, carddir):
+            return corpus
+        corpus.close()
+        logger.info('Card files changed, rebuilding card corpus')
+    compile_corpus(carddir, corpusfile)
+    return Corpus(corpusfile)
+
+
+def load(carddir, corpusfile):
+    """ return a list of every Card in carddir, via the compiled corpus """
+    corpus = open_corpus(carddir, corpusfile)
+    try:
+        return corpus.cards()
+    finally:
+        corpus.close()
+
+
+if __name__ == '__main__':
+    carddir = sys.argv[1] if len(sys.argv) > 1 else 'cards'
+    corpusfile = sys.argv[2] if len(sys.argv) > 2 else 'cards.corpus'
+    compile_corpus(carddir, corpusfile)
@@ -1,9 +1,11 @@
 # vi: set expandtab ai:
 
 from random import shuffle
+from array import array
 import json
-from card import Card
+from card import Card, kept
 from exceptions import NoMoreCards
+import metrics
 
 class Deck(object):
     """ a Deck represents a set of cards, and may contain either
@@ -19,6 +21,7 @@ class Deck(object):
                 self.add(thiscard)
         self.dealt_answers = []
         self.dealt_questions = []
+        self.discards = []
 
     def add(self, thiscard):
         """ add a Card to the Deck """
@@ -32,7 +35,10 @@ class Deck(object):
         cards, and putting it in the appropriate dealt card stack. """
         if cardtype == 'Answer':
             if num is None:
-                card = self.answercards.pop()
+                try:
+                    card = self.answercards.pop()
+                except IndexError:
+                    raise NoMoreCards
             else:
                 card = self.answercards.pop(num)
             self.dealt_answers.append(card)
@@ -52,6 +58,28 @@ class Deck(object):
         shuffle(self.answercards)
         shuffle(self.questioncards)
 
+    def discard(self, card):
+        """ a dealt Card has been played and may be dealt again later """
+        self.discards.append(card)
+
+    def recycle(self, cardtype):
+        """ shuffle the discarded cards of cardtype back into the deck,
+        returning how many were recycled.  cards discarded twice, or
+        never dealt, are only recycled once if at all. """
+        dealt = (self.dealt_answers if cardtype == 'Answer' else
+                 self.dealt_questions)
+        available = (self.answercards if cardtype == 'Answer' else
+                     self.questioncards)
+        discards = set(card for card in self.discards
+                       if card.cardtype == cardtype)
+        self.discards = [card for card in self.discards
+                         if card.cardtype != cardtype]
+        recycled = [card for card in dealt if card in discards]
+        dealt[:] = [card for card in dealt if card not in discards]
+        shuffle(recycled)
+        available[:0] = recycled
+        return len(recycled)
+
     def __len__(self):
         """ special function for length,  """
         return len(self.questioncards) + len(self.answercards)
@@ -61,10 +89,11 @@ class Deck(object):
             cards = json.load(fp)
 
             for tmpcard in cards:
-                newcard = Card(tmpcard['type'], tmpcard['value'])
-                newcard.pick = tmpcard['pick']
-                newcard.draw = tmpcard['draw']
-                newcard.source = tmpcard['source']
+                if not kept(tmpcard.get('keep', 'Yes')):
+                    continue
+                newcard = Card(tmpcard['type'], tmpcard['value'],
+                               tmpcard['pick'], tmpcard['draw'],
+                               tmpcard['source'])
                 self.add(newcard)
 
     def show_hand(self, cardtype):
@@ -92,3 +121,197 @@ class Deck(object):
         elif cardtype == 'Question':
             card = self.dealt_questions.pop()
             self.questioncards.append(card)
+
+
+class CardStack(object):
+    """ the card ids of one card type, kept in a single array.  ids[:top]
+    are available, and the next deal comes from ids[top - 1]; ids[top:]
+    have been dealt, most recent first.  dealing, undealing and reset
+    just move the top cursor.  add, deal(num) and recycle shift the
+    dealt cards along so they stay in order. """
+
+    def __init__(self, cardids):
+        self.ids = array('I', cardids)
+        self.top = len(self.ids)
+        self.discards = array('I')
+
+    def add(self, cardid):
+        """ add a card id as the next card to be dealt """
+        # the dealt cards above move up one, keeping their order
+        self.ids.insert(self.top, cardid)
+        self.top += 1
+
+    def deal(self, num=None):
+        if num is None:
+            if not self.top:
+                raise IndexError('deal from empty stack')
+            self.top -= 1
+            return self.ids[self.top]
+        # keep the order of the remaining cards, as list.pop(num) would
+        if num < 0:
+            num += self.top
+        if not 0 <= num < self.top:
+            raise IndexError('deal index out of range')
+        cardid = self.ids[num]
+        self.ids[num:self.top - 1] = self.ids[num + 1:self.top]
+        self.top -= 1
+        self.ids[self.top] = cardid
+        return cardid
+
+    def undeal_last(self):
+        if self.top == len(self.ids):
+            raise IndexError('no dealt cards to undeal')
+        self.top += 1
+
+    def reset(self):
+        self.top = len(self.ids)
+        self.discards = array('I')
+
+    def shuffle(self, start=0, end=None):
+        """ shuffle the available cards, or just ids[start:end] """
+        end = self.top if end is None else end
+        cards = self.ids[start:end].tolist()
+        shuffle(cards)
+        self.ids[start:end] = array('I', cards)
+
+    def discard(self, cardid):
+        """ mark a dealt card as finished with, ready to be recycled """
+        self.discards.append(cardid)
+
+    def recycle(self):
+        """ move the discarded cards onto the top of the available cards
+        and shuffle them.  cards still in players' hands are left dealt,
+        in order.  this is one pass over the dealt cards, O(dealt), and
+        only happens when the stack has run out.  returns the number of
+        cards recycled. """
+        discards = set(self.discards)
+        self.discards = array('I')
+        start = self.top
+        dealt = self.ids[start:]
+        recycled = [cardid for cardid in dealt if cardid in discards]
+        if not recycled:
+            return 0
+        # the cards still dealt keep their order, so undeal_last and
+        # dealt() are unaffected
+        kept = [cardid for cardid in dealt if cardid not in discards]
+        self.ids[start:] = array('I', recycled + kept)
+        self.top += len(recycled)
+        # recycled cards sit on top of the stack; shuffle just those
+        self.shuffle(start, self.top)
+        return len(recycled)
+
+    def available(self):
+        return self.ids[:self.top].tolist()
+
+    def dealt(self):
+        """ dealt card ids, in the order they were dealt """
+        return self.ids[self.top:][::-1].tolist()
+
+    def __len__(self):
+        return self.top
+
+
+class PoolDeck(Deck):
+    """ a Deck backed by a shared CardPool.  rather than Card objects it
+    keeps compact arrays of integer card ids (see CardStack), and deal()
+    hands out the pool's Card. """
+
+    def __init__(self, pool, cardids=None):
+        """ cardids limits the deck to part of the pool; by default the
+        deck holds every card in the pool """
+        self.pool = pool
+        if cardids is None:
+            answers, questions = pool.answers, pool.questions
+        else:
+            answers = [i for i in cardids if pool.cardtype(i) == 'Answer']
+            questions = [i for i in cardids
+                         if pool.cardtype(i) == 'Question']
+        self.answers = CardStack(answers)
+        self.questions = CardStack(questions)
+
+    def stack(self, cardtype):
+        return self.answers if cardtype == 'Answer' else self.questions
+
+    def add(self, thiscard):
+        """ add a pool Card to the Deck """
+        self.stack(thiscard.cardtype).add(thiscard.id)
+
+    def deal(self, cardtype, num=None):
+        """ deal a Card; when the stack runs out, the discarded cards
+        are shuffled back in first """
+        stack = self.stack(cardtype)
+        if num is None and not stack.top and stack.discards:
+            self.recycle(cardtype)
+        try:
+            return self.pool[stack.deal(num)]
+        except IndexError:
+            if num is None:
+                raise NoMoreCards
+            raise
+
+    def shuffle(self):
+        self.answers.shuffle()
+        self.questions.shuffle()
+
+    def __len__(self):
+        return len(self.answers) + len(self.questions)
+
+    def show_hand(self, cardtype):
+        return [self.pool[i].value for i in self.stack(cardtype).available()]
+
+    def reset(self):
+        self.answers.reset()
+        self.questions.reset()
+
+    def undeal_last(self, cardtype):
+        if cardtype in ('Answer', 'Question'):
+            self.stack(cardtype).undeal_last()
+
+    def discard(self, card):
+        """ a dealt Card has been played and may be dealt again later.
+        cards that aren't from the pool are ignored. """
+        if card.id is not None and self.pool[card.id] is card:
+            self.stack(card.cardtype).discard(card.id)
+
+    def recycle(self, cardtype):
+        """ shuffle the discarded cards of cardtype back into the deck,
+        returning how many were recycled """
+        recycled = self.stack(cardtype).recycle()
+        if recycled:
+            metrics.RECYCLES.inc(cardtype)
+            metrics.RECYCLED_CARDS.inc(cardtype, recycled)
+        return recycled
+
+    # id and Card views, for code written against the plain Deck
+
+    @property
+    def answerids(self):
+        return self.answers.available()
+
+    @property
+    def questionids(self):
+        return self.questions.available()
+
+    @property
+    def dealt_answerids(self):
+        return self.answers.dealt()
+
+    @property
+    def dealt_questionids(self):
+        return self.questions.dealt()
+
+    @property
+    def answercards(self):
+        return [self.pool[i] for i in self.answerids]
+
+    @property
+    def questioncards(self):
+        return [self.pool[i] for i in self.questionids]
+
+    @property
+    def dealt_answers(self):
+        return [self.pool[i] for i in self.dealt_answerids]
+
+    @property
+    def dealt_questions(self):
+        return [self.pool[i] for i in self.dealt_questionids]
@@ -1,39 +1,67 @@
 # vi: set expandtab ai wm=1:
 
-import os
-import re
 import logging
 #from typing import List
 import config
-from deck import Deck
+import cardpool
+import stats
+import snapshot
+import uuid
+from deck import Deck, PoolDeck
 from card import Card
 from player import Player
 import cmdparser as parser
 import cahirc as irc
 from random import shuffle
-from exceptions import NotPermitted
-from util import logtime
+from sendqueue import message_limit
+from concurrent.futures import ThreadPoolExecutor
+from irc.dict import IRCDict
+from exceptions import NotPermitted, NoMoreCards
+import metrics
 
 logger = logging.getLogger(__name__)
 
+_prefetcher = None
+
 class Game(object):
-    def __init__(self):
+    def __init__(self, channel=None, bot=None):
+        """ a game hosted in channel (default_channel by default).  if
+        bot is a Cahirc the game shares its connection, otherwise the
+        game opens its own. """
         self.status_codes = ['inactive', 'wait_players', 'wait_answers',
             'wait_czar', 'announcing']
         self._status = 'invalid'
+        self.phase_started = None
         self.status = 'inactive'
         self.round_num = 0
-        self.players = []
+        self.players = [] # in turn order, for czar rotation
+        self.nicks = IRCDict() # nick -> Player
         self._czar = 0
         self.question = None
         self.answers = {}
         self.answer_order = {}
         self.deck = Deck()
+        self.selected_packs = None # packs in play; None for all of them
         self.configobj = config.Config()
         self.config = self.configobj.data
         self.lang = self.config['language']
-        self.channel = self.config['default_channel']
-        self.irc = irc.Cahirc(self)
+        self.text = self.configobj.text[self.lang]
+        self.channel = channel or self.config['default_channel']
+        self.cmdparser = parser.CmdParser(self)
+        self.stats = stats.get_store(self.config.get('statsfile'))
+        self.game_id = None
+        self.deadline = None # Timer for the current phase
+        if bot is None:
+            self.irc = irc.Cahirc(self)
+        else:
+            self.irc = bot.add_game(self.channel, self)
+        snapshotdir = self.config.get('snapshotdir')
+        self.journal = None
+        if snapshotdir:
+            self.journal = snapshot.Journal(snapshotdir, self.channel)
+            self.resume()
+        self.next_deck = None
+        self.prefetch_deck(self.config.get('packs'))
 
     def __repr__(self):
         return ('Game round: {round}; status: {status}; czar: '
@@ -47,23 +75,22 @@ class Game(object):
         """ show a player's hand """
         self.irc.destination = player.nick
         if self.status in ['inactive', 'wait_players']:
-            self.irc.say(self.get_text('game_not_started'))
+            self.irc.say(self.render('game_not_started'))
             return
-        annc = self.get_text('question_announcement')
-        annc = annc.format(card=self.question.formattedvalue)
-        self.irc.say(annc)
+        self.irc.say(self.render('question_announcement',
+                                 card=self.question.formattedvalue))
         self.show_hand(player)
 
     def commands(self, player, args):
-        self.irc.say(parser.CmdParser(self).get_commands())
+        self.irc.say(parser.COMMAND_LIST)
 
     def help(self, player, args):
-        self.irc.say(self.get_text('help_blurb'))
+        self.irc.say(self.render('help_blurb'))
 
     def join(self, player, args):
         """ add a new player to the game """
-        if player in self.players:
-            self.irc.say(self.get_text('double_join'))
+        if self.get_player(player.nick) is not None:
+            self.irc.say(self.render('double_join'))
         else:
             self.add_player(player)
 
@@ -71,20 +98,19 @@ class Game(object):
         """ list players currently in the game """
         playerlist = [player.nick for player in self.players]
         players = playerlist_format(playerlist)
-        annc = self.get_text('player_list')
-        annc = annc.format(players=players)
-        self.irc.say(annc)
+        self.irc.say(self.render('player_list', players=players))
  
 
-    @logtime
+    @metrics.timed
     def play(self, player, cards):
         """ cards is an array of Card objects """
         if self.status != 'wait_answers':
             return
         if player == self.czar:
-            self.irc.say(self.get_text('not_player'))
+            self.irc.say(self.render('not_player'))
             return
         if player not in self.answers:
+            player.idle = 0
             self.answers[player] = {}
             if type(cards) is not list:
                 self.answers[player]['cards'] = [cards]
@@ -92,71 +118,99 @@ class Game(object):
                 self.answers[player]['cards'] = cards
             answer = self.format_answer(self.answers[player]['cards'])
             self.irc.destination = player.nick
-            self.irc.say(self.get_text('answer_played').format(answer=answer))
+            self.irc.say(self.render('answer_played', answer=answer))
             self.irc.destination = self.irc.channel
         else:
-            self.irc.say(self.get_text('already_played'))
+            self.irc.say(self.render('already_played'))
             for i in range(self.question.pick):
-                player.deck.undeal_last('Answer')
+                player.undeal_last()
             return
         if len(self.answers) == len(self.players) - 1:
             self.status = 'wait_czar'
-            annc = self.get_text('all_cards_played')
+            annc = self.render('all_cards_played')
             self.announce_answers(annc)
+            self.set_deadline('czar_timeout', self.czar_expired)
+
+    def packs(self, player: Player=None, args=None) -> None:
+        """ list the card packs a game can be started with """
+        sizes = self.card_pool().pack_sizes()
+        packs = ', '.join('{} ({})'.format(name, sizes[name])
+                          for name in sorted(sizes))
+        self.irc.say(self.render('pack_list', packs=packs))
 
     def quit(self, player: Player=None, args=None) -> None:
         """ remove player from the game """
-        text = self.get_text('quit_message')
-        new_players = []
-        for pl in self.players:
-            if pl != player:
-                new_players.append(pl)
-            else:
-                self.irc.say(text.format(player=player.nick))
-        if new_players:
-            self.players = new_players
-        else:
+        if player is not None and self.nicks.get(player.nick) is player:
+            self.remove_player(player)
+            self.irc.say(self.render('quit_message', player=player.nick))
+        if not self.players:
             self.end_game()
             
     def reload(self, player, args):
-        """ reload config files (cards reload with each game) """
+        """ reload config files, and the card pool with the next game """
         if self.status != 'inactive':
-            self.irc.say(self.get_text('reload_wait'))
+            self.irc.say(self.render('reload_wait'))
             return
         self.configobj.reload()
+        cardpool.reset()
         self.config = self.configobj.data
+        self.lang = self.config['language']
+        self.text = self.configobj.text[self.lang]
+        self.prefetch_deck(self.config.get('packs'))
 
     def score(self, player: Player=None, args=None) -> None:
         """ report the current score """
         if self.status == 'inactive':
             return
         scores = self.score_list()
-        text = self.get_text('score_announcement')
-        text = text.format(scores=scores)
-        self.irc.say(text)
+        self.irc.say(self.render('score_announcement', scores=scores))
+
+    def top(self, player: Player=None, args=None) -> None:
+        """ report the all-time best players """
+        if not self.stats:
+            self.irc.say(self.render('stats_disabled'))
+            return
+        text = self.get_text('score_element')
+        scores = [text.render(player=nick, points=points,
+                              point_word='point' if points == 1 else 'points')
+                  for nick, points in self.stats.top_players()]
+        self.irc.say(self.render('top_players', scores=', '.join(scores)))
 
     def start(self, player: Player=None, args=None) -> None:
-        # args are not used in this function
+        """ args name the card packs to play with; by default the packs
+        setting, or else every pack """
         if self.status != 'inactive':
-            self.irc.say(self.get_text('game_already_started'))
+            self.irc.say(self.render('game_already_started'))
+            return
+        packs, unmatched = self.choose_packs(args or
+                                             self.config.get('packs'))
+        if unmatched:
+            self.irc.say(self.render('unknown_packs',
+                                     packs=', '.join(unmatched)))
             return
+        self.selected_packs = packs
         self.status = 'wait_players'
-        self.irc.say(self.get_text('round_start'))
+        self.game_id = uuid.uuid4().hex
+        if self.stats:
+            self.stats.game_started(self.game_id, self.channel,
+                                    player and player.nick,
+                                    player and player.user)
+        self.irc.say(self.render('round_start'))
         if player is not None:
             self.add_player(player)
-        self.load_cards()
-        self.deck.shuffle()
+        self.deck = self.take_deck()
+        # get the deck for the next game ready while this one runs
+        self.prefetch_deck(self.selected_packs)
         logger.info('Starting new game')
 
     def state(self, player, args):
         """ report current game state """
         text = self.get_text('status')
         if self.status == 'inactive':
-            self.irc.say(text['inactive'])
+            self.irc.say(text.render('inactive'))
         elif self.status == 'wait_players':
-            msg = text['wait_players']
-            msg = msg.format(num=self.config['min_players']-len(self.players))
-            self.irc.say(msg)
+            num = self.config['min_players'] - len(self.players)
+            self.irc.say(text.render('wait_players', num=num))
         elif self.status == 'wait_answers':
             all_players = set([player.nick for player in self.players]) 
             played = set([player.nick for player in self.answers])
@@ -165,30 +219,32 @@ class Game(object):
             playerlist = playerlist - czar
             players = playerlist_format(list(playerlist))
             question = self.question.formattedvalue
-            msg = text['wait_answers']
-            msg = msg.format(players=players, question=question)
-            self.irc.say(msg)
+            self.irc.say(text.render('wait_answers', players=players,
+                                     question=question))
         elif self.status == 'wait_czar':
-            msg = text['wait_czar']
-            msg = msg.format(czar=self.czar.nick)
-            self.announce_answers(msg)
+            self.announce_answers(text.render('wait_czar',
+                                              czar=self.czar.nick))
 
-    @logtime
+    @metrics.timed
     def winner(self, player:Player, args):
         """ record the winner of the round """
         if player != self.czar:
-            self.irc.say(self.get_text('not_czar'))
+            self.irc.say(self.render('not_czar'))
             return
         answer_num = args[0]
+        player.idle = 0
         person = self.answer_order[answer_num]
         person.record_win()
+        if self.stats:
+            self.stats.round_won(self.game_id, self.round_num, person.nick)
         self.announce_winner(person)
+        self.discard_round()
         self.next_czar()
         self.top_up_hands()
         game_winner = self.get_game_winner()
         if game_winner:
             self.announce_game_winner()
-            self.end_game()
+            self.end_game(self.get_player(game_winner))
         else:
             self.start_round()
             self.answers = {}
@@ -198,64 +254,111 @@ class Game(object):
     #-----------------------------------------------------------------
 
     def announce_game_winner(self):
-        game_winner = self.get_text('game_winner')
-        score_element = self.get_text('score_element')
         scores = self.score_list()
-        self.irc.say(game_winner.format(player=self.get_game_winner(),
-                                        points=self.config['max_points'],
-                                        scores=scores))
+        self.irc.say(self.render('game_winner',
+                                 player=self.get_game_winner(),
+                                 points=self.config['max_points'],
+                                 scores=scores))
 
     # guaranteed not to get a duplicate player
     def add_player(self, player):
-        if player not in self.players:
+        if player.nick not in self.nicks:
+            self.nicks[player.nick] = player
             self.players.append(player)
+            if self.stats and self.game_id is not None:
+                self.stats.player_joined(self.game_id, player.nick,
+                                         player.user)
         players = len(self.players)
         min_players = self.config['min_players']
         game_states = ['wait_answers', 'wait_czar', 'announcing']
         if players >= min_players and self.status == 'wait_players':
-            text = self.get_text('welcome_start')
-            text = text.format(name=player.nick)
-            self.irc.say(text)
+            self.irc.say(self.render('welcome_start', name=player.nick))
             self.commence()
         elif players >= min_players and self.status in game_states:
-            self.deal_one_player(player, self.config['hand_size'])
-            text = self.get_text('welcome_join')
-            text = text.format(name=player.nick)
-            self.irc.say(text)
+            num = self.config['hand_size']
+            if self.status == 'wait_answers':
+                num += self.question.draw
+            self.deal_one_player(player, num)
+            self.irc.say(self.render('welcome_join', name=player.nick))
             self.show_hand(player)
         else:
-            text = self.get_text('welcome_wait')
             num = min_players - players
             player_word = 'players' if num > 1 else 'player'
-            text = text.format(name=player.nick, num=num, 
-                               player_word=player_word)
-            self.irc.say(text)
+            self.irc.say(self.render('welcome_wait', name=player.nick,
+                                     num=num, player_word=player_word))
+
+    def remove_player(self, player):
+        # the cards the player held go back into play
+        for card in player.deck.answercards + player.deck.dealt_answers:
+            self.deck.discard(card)
+        del self.nicks[player.nick]
+        # a new list rather than a change in place, so that a copy of
+        # self.players taken before the quit still lists everyone who
+        # was playing; it costs O(players), like the search for the seat
+        seat = self.players.index(player)
+        self.players = self.players[:seat] + self.players[seat + 1:]
+        # keep the czar where it was; if the czar left, the next
+        # player in turn takes over
+        if seat < self._czar:
+            self._czar -= 1
+        elif self._czar >= len(self.players):
+            self._czar = 0
 
     def get_player(self, nick: str) -> Player:
-        for player in self.players:
-            if player.nick == nick:
-                return player
-        return None
+        """ the Player with nick, compared the way IRC does """
+        return self.nicks.get(nick)
 
     def get_text(self, key):
-        return self.config['text'][self.lang][key]
+        """ the compiled Template (or group of Templates) for key """
+        return self.text[key]
 
-    def end_game(self):
+    def render(self, key, **kwargs):
+        return self.text[key].render(**kwargs)
+
+    def end_game(self, winner: Player=None) -> None:
+        if winner is not None:
+            for player in self.players:
+                if player is winner:
+                    player.game_win()
+                else:
+                    player.game_loss()
+        if self.stats and self.game_id is not None:
+            self.stats.game_ended(self.game_id, winner and winner.nick,
+                                  [player.nick for player in self.players])
+        self.game_id = None
+        self.cancel_deadline()
         self.status = 'inactive'
         self.round_num = 0
         self.players = []
+        self.nicks = IRCDict()
         self._czar = 0
         self.question = None
         self.answers = {}
         self.answer_order = {}
         self.deck = Deck()
-        self.irc.say(self.get_text('game_start'))
+        self.irc.say(self.render('game_start'))
 
     def next_czar(self) -> None:
         self._czar += 1
         self._czar %= len(self.players)
         return self.czar
 
+    def discard_round(self):
+        """ the round's question and the answers played to it are
+        finished with, and may be recycled """
+        if self.question is not None:
+            self.deck.discard(self.question)
+        for player in self.players:
+            for card in player.deck.dealt_answers:
+                self.deck.discard(card)
+            player.deck.dealt_answers = []
+
+    def out_of_cards(self):
+        """ every card is in play or in a hand, so the game can't go on """
+        self.irc.destination = self.irc.channel
+        self.irc.say(self.render('out_of_cards'))
+        self.end_game()
+
     def commence(self) -> None:
         self.deal_all_players(self.config['hand_size'])
         self.start_round()
@@ -263,35 +366,195 @@ class Game(object):
     def start_round(self):
         self.round_num += 1
         self.status = 'wait_answers'
+        if self.stats:
+            self.stats.round_started(self.game_id, self.round_num)
         self.question = self.deck.deal('Question')
+        if self.question.draw:
+            self.top_up_hands(self.question.draw)
         q_text = self.question.formattedvalue
-        round_annc = self.get_text('round_announcement')
-        round_annc = round_annc.format(round_num=self.round_num,
-            czar=self.czar.nick)
-        card_annc = self.get_text('question_announcement')
-        self.irc.say(round_annc)
-        self.irc.say(card_annc.format(card=q_text))
+        self.irc.say(self.render('round_announcement',
+                                 round_num=self.round_num,
+                                 czar=self.czar.nick))
+        self.irc.say(self.render('question_announcement', card=q_text))
         self.show_hands()
+        self.set_deadline('answer_timeout', self.answers_expired)
+
+    #-----------------------------------------------------------------
+    # deadlines
+    #-----------------------------------------------------------------
+
+    def set_deadline(self, key, callback):
+        """ call callback once the number of seconds in config key has
+        passed, replacing the current phase's deadline.  a missing or
+        zero setting means no deadline. """
+        self.cancel_deadline()
+        seconds = self.config.get(key)
+        if seconds:
+            self.deadline = self.irc.timers.schedule(seconds, self.expire,
+                                                     callback)
+
+    def cancel_deadline(self):
+        if self.deadline is not None:
+            self.deadline.cancel()
+            self.deadline = None
+
+    def expire(self, callback):
+        """ run the callback for a deadline that has passed """
+        self.deadline = None
+        try:
+            callback()
+        except NoMoreCards:
+            self.out_of_cards()
+        self.save_state()
+
+    def answers_expired(self):
+        """ time's up for answers: strike everyone who didn't play, and
+        let the czar judge the answers that are in """
+        if self.status != 'wait_answers':
+            return
+        self.irc.destination = self.irc.channel
+        czar = self.czar
+        idle = [player for player in self.players
+                if player is not czar and player not in self.answers]
+        self.strike(idle)
+        if len(self.players) < 2:
+            self.end_game()
+        elif self.answers:
+            self.status = 'wait_czar'
+            players = playerlist_format([player.nick for player in idle])
+            self.announce_answers(self.render('answers_timeout',
+                                              players=players))
+            self.set_deadline('czar_timeout', self.czar_expired)
+        else:
+            self.irc.say(self.render('round_skipped'))
+            self.discard_round()
+            self.next_czar()
+            self.start_round()
 
-    @logtime
+    def czar_expired(self):
+        """ time's up for the czar: nobody scores, and the next player
+        in turn becomes czar """
+        if self.status != 'wait_czar':
+            return
+        self.irc.destination = self.irc.channel
+        czar = self.czar
+        self.irc.say(self.render('czar_timeout', czar=czar.nick))
+        self.strike([czar])
+        if len(self.players) < 2:
+            self.end_game()
+        else:
+            self.discard_round()
+            # an evicted czar's seat has already passed to the next player
+            if self.czar is czar:
+                self.next_czar()
+            self.top_up_hands()
+            self.answers = {}
+            self.start_round()
+
+    def strike(self, players):
+        """ count a missed deadline against each of players, removing
+        those who have missed max_idle in a row """
+        max_idle = self.config.get('max_idle', 2)
+        for player in players:
+            player.idle += 1
+            if max_idle and player.idle >= max_idle:
+                self.remove_player(player)
+                self.irc.say(self.render('idle_evicted', player=player.nick))
+
+    @metrics.timed
     def load_cards(self):
-        self.deck = Deck()
-        currdir = os.getcwd()
-        os.chdir(self.config['carddir'])
-        files = os.listdir()
-        for thisfile in files:
-            if thisfile.endswith('json'):
-                self.deck.read_in(thisfile)
-        os.chdir(currdir)
+        pool = self.card_pool()
+        self.deck = PoolDeck(pool, self.select_cards(pool,
+                                                     self.selected_packs))
+
+    def select_cards(self, pool, packs):
+        """ the ids of the cards in packs to play with, as the config
+        asks """
+        return pool.select(packs, self.config.get('prefer_packs'),
+                           self.config.get('max_pick'))
+
+    def choose_packs(self, words):
+        """ (packs, unmatched words) for the packs named by words;
+        packs is None, meaning every pack, if no words are given """
+        if not words:
+            return None, []
+        return self.card_pool().match_packs(words)
+
+    def build_deck(self, words):
+        """ (packs, shuffled deck) for the packs named by words """
+        packs, unmatched = self.choose_packs(words)
+        pool = self.card_pool()
+        deck = PoolDeck(pool, self.select_cards(pool, packs))
+        deck.shuffle()
+        return packs, deck
+
+    def prefetch_deck(self, words):
+        """ build and shuffle a deck in a worker thread, for the next
+        start to pick up """
+        self.next_deck = prefetcher().submit(self.build_deck, words)
+
+    def take_deck(self):
+        """ the prefetched deck, if it is of the selected packs and the
+        current pool, or else a freshly shuffled one """
+        future, self.next_deck = self.next_deck, None
+        if future is not None:
+            try:
+                packs, deck = future.result()
+            except Exception:
+                logger.exception('Unable to prefetch deck')
+            else:
+                if (packs == self.selected_packs and
+                        deck.pool is self.card_pool()):
+                    return deck
+        self.load_cards()
+        self.deck.shuffle()
+        return self.deck
+
+    def card_pool(self):
+        corpusfile = self.config.get('corpusfile', 'cards.corpus')
+        return cardpool.get_pool(self.config['carddir'], corpusfile)
 
     def command(self, parser):
         if parser.command is None:
             return
-        msg = '{player} called {cmd} command'.format(player=parser.player,
-                                                     cmd=parser.command)
-        logger.info(msg)
+        logger.info('%s called %s command', parser.player, parser.command)
         func = getattr(self, parser.command)
-        func(parser.player, parser.args)
+        started = metrics.start()
+        try:
+            func(parser.player, parser.args)
+        except NoMoreCards:
+            self.out_of_cards()
+        metrics.COMMANDS.observe_since(started, parser.command)
+        self.save_state()
+
+    def save_state(self):
+        """ journal the game if it has changed, so it survives a
+        restart """
+        if self.journal is None:
+            return
+        if self.status == 'inactive':
+            self.journal.clear()
+            return
+        self.journal.save(self)
+
+    def resume(self):
+        """ pick up the game from the journal, if there is one """
+        state = self.journal.latest()
+        if state is None or not snapshot.restore(self, state,
+                                                 self.card_pool()):
+            self.journal.clear()
+            return
+        self.journal.resumed(self)
+        if self.status == 'wait_answers':
+            self.set_deadline('answer_timeout', self.answers_expired)
+        elif self.status == 'wait_czar':
+            self.set_deadline('czar_timeout', self.czar_expired)
+
+    def greeting(self):
+        """ what to say on joining the channel """
+        if self.status == 'inactive':
+            return self.render('game_start')
+        return self.render('game_resumed', round_num=self.round_num)
 
     def deal_one_player(self, player, num):
         for i in range(num):
@@ -305,20 +568,20 @@ class Game(object):
                 card = self.deck.deal('Answer')
                 player.add_card(card)
 
-    def top_up_hands(self):
+    def top_up_hands(self, draw=0):
+        """ deal each player back up to hand_size cards, and everyone
+        but the czar draw cards more on top """
         for player in self.players:
-            missing = self.config['hand_size'] - len(player.deck)
-            if missing:
-                for i in range(missing):
-                    card = self.deck.deal('Answer')
-                    player.add_card(card)
+            size = self.config['hand_size']
+            if player is not self.czar:
+                size += draw
+            for i in range(size - len(player.deck)):
+                player.add_card(self.deck.deal('Answer'))
 
     def announce_winner(self, player:Player) -> None:
-        text = self.get_text('winner_announcement')
-        text = text.format(player=player.nick,
+        self.irc.say(self.render('winner_announcement', player=player.nick,
             card=self.format_answer(self.answers[player]['cards']),
-            points=player.points)
-        self.irc.say(text)
+            points=player.points))
 
     def announce_answers(self, text):
         self.irc.say(text)
@@ -326,27 +589,28 @@ class Game(object):
         for i, player in enumerate(players):
             cards = self.answers[player]['cards']
             self.irc.say('[{}] {}'.format(i, self.format_answer(cards)))
-        self.irc.say(self.get_text('czar_pick').format(czar=self.czar.nick))
+        self.irc.say(self.render('czar_pick', czar=self.czar.nick))
  
     def format_answer(self, cards):
-        # TODO: add extra {}s on the end to add up to the PICK number
-        spaces = self.question.value.count('%s')
-        remain_space = len(cards) - spaces
-        text = re.sub('%s', '{}', self.question.value)
+        """ fill the question's blanks with the answers, adding any
+        answers beyond the number of blanks on the end """
+        segments = self.question.segments
+        blanks = self.question.blanks
         if isinstance(cards[0], Card):
             answers = [card.value for card in cards]
         else:
             answers = cards
-        if remain_space:
-            text += ' ' + ' '.join(['{}' for i in range(remain_space)])
-        try:
-            text = text.format(*answers)
-        except IndexError as err:
-            # TODO: replace this with logging calls
-            print('incorrect number of cards supplied')
-            print('cards: {}'.format(cards))
-            print('question: {}'.format(self.question.value))
-        return text
+        if len(answers) < blanks:
+            logger.error('incorrect number of cards supplied: {} for '
+                         'question: {}'.format(cards, self.question.value))
+            answers = answers + ['___'] * (blanks - len(answers))
+        pieces = [segments[0]]
+        for answer, segment in zip(answers, segments[1:]):
+            pieces.append(answer)
+            pieces.append(segment)
+        if len(answers) > blanks:
+            pieces.append(' ' + ' '.join(answers[blanks:]))
+        return ''.join(pieces)
 
     def randomize_answers(self):
         players = list(self.answers.keys())
@@ -365,22 +629,16 @@ class Game(object):
     def show_hand(self, player):
         if player == self.czar:
             return
-        hand = player.show_hand()
-        annc = self.get_text('player_hand')
-        handstring = ''
-        i = 0
-        for card in hand:
-            handstring += '[{}] {} '.format(i, card)
-            i += 1
         self.irc.destination = player.nick
-        self.irc.say(annc.format(cards=handstring))
+        self.irc.say('\n'.join(player.hand_lines(self.get_text('player_hand'),
+                                                 message_limit(player.nick))))
 
     def score_list(self):
         max_points = self.config['max_points']
         text = self.get_text('score_element')
         def point_word(points):
             return 'point' if points == 1 else 'points'
-        score_order = [text.format(player=pl.nick, points=pl.points,
+        score_order = [text.render(player=pl.nick, points=pl.points,
                        point_word=point_word(pl.points)) for pl in 
                        sorted(self.players, key=lambda p: max_points -
                        p.points)]
@@ -405,6 +663,10 @@ class Game(object):
     @status.setter
     def status(self, state):
         if state in self.status_codes:
+            if self._status not in ('invalid', 'inactive'):
+                metrics.PHASES.observe_since(self.phase_started,
+                                             self._status)
+            self.phase_started = metrics.start()
             self._status = state
         else:
             raise ValueError('No such game state')
@@ -422,3 +684,12 @@ def playerlist_format(playerlist):
         return ' and '.join(playerlist)
     if size > 2:
         return ', '.join(playerlist[0:-1]) + ' and ' + playerlist[-1]
+
+
+def prefetcher():
+    """ the worker thread decks are prefetched on, shared by all games """
+    global _prefetcher
+    if _prefetcher is None:
+        _prefetcher = ThreadPoolExecutor(max_workers=1,
+                                         thread_name_prefix='prefetch')
+    return _prefetcher
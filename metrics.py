@@ -0,0 +1,210 @@
+# vi: set expandtab ai:
+"""
+counters and latency histograms for the bot, readable in the Prometheus
+text format from a local HTTP endpoint (metrics_port) or written to the
+log every metrics_interval seconds.  everything is off until enable()
+is called, and while off each recording call returns straight away.
+"""
+
+import time
+import logging
+import functools
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+           0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_enabled = False
+_families = []
+
+
+class Histogram(object):
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1) # the last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+
+
+class Family(object):
+    """ one named metric, with a value per label value.  kind is
+    'counter', 'gauge' or 'histogram'. """
+
+    def __init__(self, name, kind, doc, label=None):
+        self.name = name
+        self.kind = kind
+        self.doc = doc
+        self.label = label
+        self.values = {}
+        _families.append(self)
+
+    def inc(self, label=None, amount=1):
+        if not _enabled:
+            return
+        self.values[label] = self.values.get(label, 0) + amount
+
+    def set(self, value, label=None):
+        if not _enabled:
+            return
+        self.values[label] = value
+
+    def observe(self, value, label=None):
+        if not _enabled:
+            return
+        histogram = self.values.get(label)
+        if histogram is None:
+            histogram = self.values[label] = Histogram()
+        histogram.observe(value)
+
+    def observe_since(self, started, label=None):
+        """ observe the time since started, a value from start() """
+        if started is not None:
+            self.observe(time.perf_counter() - started, label)
+
+    def labels(self, label, extra=''):
+        if label is None:
+            return '{' + extra + '}' if extra else ''
+        pair = '{}="{}"'.format(self.label, label.replace('"', '\\"'))
+        return '{' + pair + (',' + extra if extra else '') + '}'
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.doc),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        for label, value in sorted(list(self.values.items()),
+                                   key=lambda item: item[0] or ''):
+            if self.kind != 'histogram':
+                lines.append('{}{} {}'.format(self.name, self.labels(label),
+                                              value))
+                continue
+            total = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), value.counts):
+                total += count
+                lines.append('{}_bucket{} {}'.format(self.name,
+                             self.labels(label, 'le="{}"'.format(bound)),
+                             total))
+            lines.append('{}_sum{} {}'.format(self.name, self.labels(label),
+                                              value.sum))
+            lines.append('{}_count{} {}'.format(self.name, self.labels(label),
+                                                total))
+        return '\n'.join(lines)
+
+
+COMMANDS = Family('cah_command_seconds', 'histogram',
+                  'Time taken to run each game command', 'command')
+PHASES = Family('cah_phase_seconds', 'histogram',
+                'Time games spend in each phase of a round', 'phase')
+CALLS = Family('cah_call_seconds', 'histogram',
+               'Time taken by timed functions', 'function')
+MESSAGES_IN = Family('cah_messages_in_total', 'counter',
+                     'Messages received by the bot')
+PARSE_REJECTS = Family('cah_parse_rejects_total', 'counter',
+                       'Messages rejected as not being commands')
+MESSAGES_OUT = Family('cah_messages_out_total', 'counter',
+                      'Lines sent by the bot')
+RECYCLES = Family('cah_recycles_total', 'counter',
+                  'Times discarded cards were shuffled back into a deck',
+                  'cardtype')
+RECYCLED_CARDS = Family('cah_recycled_cards_total', 'counter',
+                        'Discarded cards shuffled back into a deck',
+                        'cardtype')
+SEND_QUEUE = Family('cah_send_queue_depth', 'gauge',
+                    'Lines waiting in the send queue')
+
+
+def enabled():
+    return _enabled
+
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+
+
+def reset():
+    """ forget everything recorded so far """
+    for family in _families:
+        family.values.clear()
+
+
+def start():
+    """ a start time for observe_since(), or None if metrics are off """
+    return time.perf_counter() if _enabled else None
+
+
+def timed(func):
+    """ decorator recording how long each call to func takes """
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            CALLS.observe(time.perf_counter() - started, name)
+    return wrapper
+
+
+def render():
+    """ every metric, in the Prometheus text format """
+    return '\n'.join(family.render() for family in _families) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def serve(port, host='127.0.0.1'):
+    """ answer metrics requests on host:port from a background thread;
+    returns the server """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics',
+                              daemon=True)
+    thread.start()
+    logger.info('Serving metrics on {}:{}'.format(host, port))
+    return server
+
+
+def dump_every(interval):
+    """ write every metric to the log every interval seconds """
+    def dump():
+        while True:
+            time.sleep(interval)
+            logger.info('Metrics:\n{}'.format(render()))
+    threading.Thread(target=dump, name='metrics-dump', daemon=True).start()
+
+
+def setup(config):
+    """ turn metrics on if the config asks for them """
+    port = config.get('metrics_port')
+    interval = config.get('metrics_interval')
+    if not (port or interval):
+        return
+    enable()
+    if port:
+        serve(port)
+    if interval:
+        dump_every(interval)
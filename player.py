@@ -1,8 +1,12 @@
 # vi: set expandtab ai:
 
 from deck import Deck
+from sendqueue import split_text
 
 class Player(object):
+    __slots__ = ('nick', 'user', 'deck', 'points', 'wins', 'games_played',
+                 'idle', '_hand_slots', '_hand_lines')
+
     def __init__(self, nick, user):
         self.nick = nick
         self.user = user
@@ -10,6 +14,9 @@ class Player(object):
         self.points = 0
         self.wins = 0
         self.games_played = 0
+        self.idle = 0 # rounds in a row the player let the deadline pass
+        self._hand_slots = [] # (card, '[i] value ') as last rendered
+        self._hand_lines = None # ((template, limit), lines) until changed
 
     def __repr__(self):
         return '{} [{}, {}/{}]'.format(self.nick, self.points,
@@ -22,7 +29,10 @@ class Player(object):
         self.points = 0
         self.wins += 1
         self.games_played += 1
-        # TODO: where do we record non-winning games_played++ ?
+
+    def game_loss(self):
+        self.points = 0
+        self.games_played += 1
 
     def get_score(self):
         return (self.points, self.wins, self.games_played)
@@ -30,8 +40,41 @@ class Player(object):
     def show_hand(self):
         return self.deck.show_hand('Answer')
 
+    def hand_slots(self):
+        """ '[i] value ' for each card in the hand.  only the slots
+        whose card has changed since the last call are rendered again. """
+        cards = self.deck.answercards
+        slots = self._hand_slots
+        for i, card in enumerate(cards):
+            if i < len(slots):
+                if slots[i][0] is card:
+                    continue
+                slots[i] = (card, '[{}] {} '.format(i, card.value))
+            else:
+                slots.append((card, '[{}] {} '.format(i, card.value)))
+        del slots[len(cards):]
+        return [text for card, text in slots]
+
+    def hand_lines(self, template, limit):
+        """ the hand as messages of at most limit bytes: the first is
+        template filled in with as many cards as fit, and any more are
+        the rest of the cards.  kept until the hand changes. """
+        key = (template, limit)
+        if self._hand_lines is None or self._hand_lines[0] != key:
+            overhead = len(template.render(cards='').encode('utf-8'))
+            lines = split_text(self.hand_slots(), limit, overhead) or ['']
+            lines[0] = template.render(cards=lines[0])
+            self._hand_lines = (key, lines)
+        return self._hand_lines[1]
+
     def add_card(self, card):
+        self._hand_lines = None
         self.deck.add(card)
 
     def deal(self, num):
+        self._hand_lines = None
         return self.deck.deal('Answer', num)
+
+    def undeal_last(self):
+        self._hand_lines = None
+        self.deck.undeal_last('Answer')
@@ -4,6 +4,9 @@ import signal
 import sys
 import logging
 import game
+import cardpool
+import metrics
+import asynclog
 from config import Config
 import cmdparser as p
 
@@ -14,7 +17,19 @@ def main():
     signal.signal(signal.SIGTERM, signal_handler)
     setup_logging()
     logger.info('Establishing IRC connection')
-    return game.Game()
+    config = Config().data
+    metrics.setup(config)
+    if config.get('transport', 'blocking') == 'asyncio':
+        import aiocahirc
+        bot = aiocahirc.AioCahirc()
+    else:
+        bot = game.irc.Cahirc()
+    for channel in config.get('channels', [config['default_channel']]):
+        game.Game(channel, bot)
+    # get the card pool loaded before anyone says 'start'
+    bot.offload(cardpool.get_pool, config['carddir'],
+                config.get('corpusfile', 'cards.corpus'))
+    return bot
 
 
 def setup_logging():
@@ -22,31 +37,32 @@ def setup_logging():
         level = logging.DEBUG
     else:
         level = logging.INFO
-    config = Config().data
-    logging.basicConfig(filename=config['logfile'],
-                        level=level,
-                        format='%(asctime)s %(levelname)s: %(message)s')
+    asynclog.setup(Config().data, level)
 
 
 def receive_msg(currgame, msg):
-    parser = p.CmdParser(currgame)
+    metrics.MESSAGES_IN.inc()
+    if not p.might_be_command(msg.msg):
+        metrics.PARSE_REJECTS.inc()
+        return
+    parser = currgame.cmdparser
     parser.parse(msg)
     currgame.command(parser)
 
 
 def signal_handler(sig, frame):
     logger.info('Shutting down from signal')
-    if maingame:
+    if mainbot:
         logger.info('Sending shutdown message via IRC')
-        lang = Config().data['language']
-        shutdown_message = Config().data['text'][lang]['shutdown_message']
-        maingame.irc.say(shutdown_message)
-        maingame.irc.die('Shutting down')
+        config = Config()
+        lang = config.data['language']
+        shutdown_message = config.text[lang].render('shutdown_message')
+        mainbot.shutdown(shutdown_message)
     else:
         logger.info('Unable to send shutdown message via IRC')
     sys.exit(0)
 
 
 if __name__ == '__main__':
-    maingame = main()
-    maingame.irc.start() # start call never returns
+    mainbot = main()
+    mainbot.start() # start call never returns
@@ -0,0 +1,106 @@
+# vi: set expandtab ai:
+"""
+rate limited queue for outbound IRC messages.  a token bucket decides
+when the next line may go out; while lines are waiting, consecutive
+lines for the same destination are joined into one message, and
+channel announcements jump ahead of private messages.
+"""
+
+import time
+from collections import deque
+
+# RFC 1459 line limit, including the trailing CRLF
+LINE_LIMIT = 512
+# room left for the ':nick!user@host ' prefix the server adds when it
+# relays our message
+PREFIX_RESERVE = 100
+SEPARATOR = ' | '
+
+# priorities, highest first
+CHANNEL = 0
+PRIVATE = 1
+
+
+def message_limit(destination):
+    """ the number of bytes of text that fit in one PRIVMSG line """
+    overhead = len('PRIVMSG {} :\r\n'.format(destination).encode('utf-8'))
+    return LINE_LIMIT - PREFIX_RESERVE - overhead
+
+
+def split_text(pieces, limit, first=0):
+    """ join pieces into as few lines of at most limit bytes as
+    possible, without breaking any piece; the first line has room for
+    first bytes fewer """
+    lines = []
+    line = []
+    size = first
+    for piece in pieces:
+        length = len(piece.encode('utf-8'))
+        if line and size + length > limit:
+            lines.append(''.join(line))
+            line = []
+            size = 0
+        line.append(piece)
+        size += length
+    if line:
+        lines.append(''.join(line))
+    return lines
+
+
+class SendQueue(object):
+    """ rate is the number of lines per second allowed in the long run,
+    burst the number that may be sent back to back after a quiet spell """
+
+    def __init__(self, rate=1.0, burst=5, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.updated = clock()
+        self.queues = (deque(), deque())
+
+    def put(self, destination, text, priority=CHANNEL):
+        queue = self.queues[priority]
+        if queue and queue[-1][0] == destination:
+            joined = queue[-1][1] + SEPARATOR + text
+            if len(joined.encode('utf-8')) <= message_limit(destination):
+                queue[-1][1] = joined
+                return
+        queue.append([destination, text])
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def get(self):
+        """ the next (destination, text) that may be sent now, or None if
+        the queue is empty or the rate limit has been reached """
+        if not len(self):
+            return None
+        self.refill()
+        if self.tokens < 1:
+            return None
+        self.tokens -= 1
+        for queue in self.queues:
+            if queue:
+                destination, text = queue.popleft()
+                return destination, text
+
+    def drain(self):
+        """ take every queued (destination, text), in the order get()
+        would give them, ignoring the rate limit """
+        messages = []
+        for queue in self.queues:
+            messages.extend((destination, text) for destination, text in queue)
+            queue.clear()
+        return messages
+
+    def delay(self):
+        """ seconds until the next line may be sent """
+        self.refill()
+        return max(0, (1 - self.tokens) / self.rate)
+
+    def __len__(self):
+        return len(self.queues[CHANNEL]) + len(self.queues[PRIVATE])
@@ -0,0 +1,236 @@
+# vi: set expandtab ai:
+"""
+crash recovery for games in progress.  whenever a command or deadline
+changes a game, the game's state is appended to a per-channel journal
+as one compact JSON line; on startup the last complete line is read
+back and the game carries on where it left off.  cards are stored as
+their CardPool ids.
+
+the order of the cards in the deck only changes when a game starts or
+the discards are recycled, so it is journalled on a line of its own
+only when it changes, and each state line holds just the deck cursors.
+the journal is rewritten with just its latest entries every so often,
+and removed when the game ends.
+"""
+
+import os
+import json
+import zlib
+import logging
+from array import array
+from urllib.parse import quote
+from deck import Deck, PoolDeck, CardStack
+from player import Player
+
+logger = logging.getLogger(__name__)
+
+VERSION = 2
+
+
+class Journal(object):
+    """ the snapshot journal for one channel's game """
+    # entries written before the journal is compacted
+    compact_every = 100
+
+    def __init__(self, directory, channel):
+        os.makedirs(directory, exist_ok=True)
+        self.filename = os.path.join(directory,
+                                     quote(channel, safe='') + '.journal')
+        self.entries = 0
+        self.layout = None # the last deck layout written
+        self.checksum = None # layout_checksum of the deck when it was
+        self.last = None # the last state written
+
+    def save(self, game):
+        """ journal game, if it has changed since it was last saved """
+        state = capture(game)
+        if state is None or state == self.last:
+            return
+        checksum = layout_checksum(game.deck)
+        self.write(state, layout(game.deck)
+                   if checksum != self.checksum else None)
+        self.checksum = checksum
+        self.last = state
+
+    def write(self, state, layout=None):
+        """ append state to the journal, after the deck layout if that
+        has changed.  compacting the journal keeps the last layout. """
+        if layout is not None:
+            self.layout = layout
+        compact = self.entries >= self.compact_every
+        lines = []
+        if layout is not None or (compact and self.layout is not None):
+            lines.append({'layout': self.layout})
+        lines.append(state)
+        text = ''.join(json.dumps(line, separators=(',', ':')) + '\n'
+                       for line in lines)
+        if compact:
+            tmpfile = self.filename + '.tmp'
+            with open(tmpfile, 'w') as fp:
+                fp.write(text)
+            os.replace(tmpfile, self.filename)
+            self.entries = 1
+        else:
+            with open(self.filename, 'a') as fp:
+                fp.write(text)
+            self.entries += 1
+
+    def latest(self):
+        """ the most recent complete snapshot, with the deck layout it
+        was taken with under 'layout', or None """
+        try:
+            with open(self.filename) as fp:
+                lines = fp.readlines()
+        except FileNotFoundError:
+            return None
+        state = layout = None
+        entries = 0
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # a crash in mid write can leave a partial last line
+                continue
+            if isinstance(entry, dict) and 'layout' in entry:
+                layout = entry['layout']
+            else:
+                state = entry
+                entries += 1
+        self.entries = entries
+        if isinstance(state, dict) and layout is not None:
+            state = dict(state, layout=layout)
+        return state
+
+    def resumed(self, game):
+        """ note that game was restored from the journal, so an unchanged
+        state isn't written again """
+        self.last = capture(game)
+        self.checksum = layout_checksum(game.deck)
+        self.layout = layout(game.deck)
+
+    def clear(self):
+        if self.entries or os.path.exists(self.filename):
+            try:
+                os.remove(self.filename)
+            except FileNotFoundError:
+                pass
+        self.entries = 0
+        self.layout = self.checksum = self.last = None
+
+
+def layout(deck):
+    """ the order of the cards in deck's answer and question stacks """
+    return [deck.answers.ids.tolist(), deck.questions.ids.tolist()]
+
+
+def layout_checksum(deck):
+    return (zlib.crc32(deck.answers.ids), zlib.crc32(deck.questions.ids))
+
+
+def stack_state(stack):
+    return [stack.top, stack.discards.tolist()]
+
+
+def restore_stack(ids, state):
+    top, discards = state
+    if not 0 <= top <= len(ids):
+        raise ValueError('deck cursor out of range')
+    stack = CardStack(ids)
+    stack.top = top
+    stack.discards = array('I', discards)
+    return stack
+
+
+def capture(game):
+    """ the state of game as a JSON-friendly dict, or None if the game is
+    not dealing from a CardPool and so can't be snapshotted """
+    if not isinstance(game.deck, PoolDeck):
+        return None
+    return {
+        'version': VERSION,
+        'pool': game.deck.pool.fingerprint,
+        'game_id': game.game_id,
+        'status': game.status,
+        'round': game.round_num,
+        'czar': game._czar,
+        'question': game.question.id if game.question else None,
+        # each player's hand, and the cards they played this round,
+        # which go on the discard pile when the round ends
+        'players': [[player.nick, player.user, player.points, player.wins,
+                     player.games_played,
+                     [card.id for card in player.deck.answercards],
+                     [card.id for card in player.deck.dealt_answers]]
+                    for player in game.players],
+        # played answers are kept as text, which is all that's needed
+        # to announce them.  a player who has quit since playing keeps
+        # their answer, so the answers keep their numbers.
+        'answers': [[player.nick, player.user,
+                     [getattr(card, 'value', card)
+                      for card in answer['cards']],
+                     answer.get('order')]
+                    for player, answer in game.answers.items()],
+        'deck': [stack_state(game.deck.answers),
+                 stack_state(game.deck.questions)],
+    }
+
+
+def restore(game, state, pool):
+    """ put game back into the state captured from it.  returns False,
+    leaving the game alone, if the snapshot doesn't fit this pool or
+    can't be read. """
+    if state.get('version') != VERSION or state.get('pool') != \
+            pool.fingerprint:
+        logger.info('Snapshot for %s is out of date, not resuming',
+                    game.channel)
+        return False
+    try:
+        deck = PoolDeck(pool, [])
+        deck.answers = restore_stack(state['layout'][0], state['deck'][0])
+        deck.questions = restore_stack(state['layout'][1], state['deck'][1])
+        players = []
+        nicks = {}
+        for (nick, user, points, wins, played, hand,
+             dealt) in state['players']:
+            player = Player(nick, user)
+            player.points, player.wins, player.games_played = (points, wins,
+                                                               played)
+            player.deck = Deck([pool[cardid] for cardid in hand])
+            player.deck.dealt_answers = [pool[cardid] for cardid in dealt]
+            players.append(player)
+            nicks[nick] = player
+        answers = {}
+        answer_order = {}
+        for nick, user, cards, order in state['answers']:
+            player = nicks.get(nick) or Player(nick, user)
+            answers[player] = {'cards': cards}
+            if order is not None:
+                answers[player]['order'] = order
+                answer_order[order] = player
+        question = (pool[state['question']]
+                    if state['question'] is not None else None)
+        game_id, round_num, czar, status = (state['game_id'],
+                                            state['round'], state['czar'],
+                                            state['status'])
+        if status not in game.status_codes:
+            raise ValueError('unknown status {!r}'.format(status))
+        if players and not 0 <= czar < len(players):
+            raise ValueError('czar {} out of range'.format(czar))
+    except (KeyError, IndexError, TypeError, ValueError) as err:
+        logger.warning('Snapshot for %s is damaged (%r), not resuming',
+                       game.channel, err)
+        return False
+    game.deck = deck
+    game.players = players
+    game.nicks.clear()
+    for nick, player in nicks.items():
+        game.nicks[nick] = player
+    game.answers = answers
+    game.answer_order = answer_order
+    game.question = question
+    game.game_id = game_id
+    game.round_num = round_num
+    game._czar = czar
+    game.status = status
+    logger.info('Resumed game in %s at round %d', game.channel,
+                game.round_num)
+    return True
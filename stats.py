@@ -0,0 +1,193 @@
+# vi: set expandtab ai:
+"""
+long-term game statistics, kept in an SQLite database (see
+doc/db-notes).  writes are queued and applied by a background thread in
+batches, one transaction per batch, so recording a round never makes the
+game wait on the disk.  reads go straight to the indexed tables.
+"""
+
+import os
+import time
+import queue
+import atexit
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    nick TEXT PRIMARY KEY COLLATE NOCASE,
+    username TEXT,
+    points INTEGER NOT NULL DEFAULT 0,
+    games_won INTEGER NOT NULL DEFAULT 0,
+    games_started INTEGER NOT NULL DEFAULT 0,
+    games_joined INTEGER NOT NULL DEFAULT 0,
+    games_played INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS users_points ON users (points DESC);
+CREATE INDEX IF NOT EXISTS users_games_won ON users (games_won DESC);
+
+CREATE TABLE IF NOT EXISTS games (
+    id TEXT PRIMARY KEY,
+    channel TEXT,
+    started REAL,
+    ended REAL,
+    rounds INTEGER NOT NULL DEFAULT 0,
+    winner TEXT COLLATE NOCASE
+);
+CREATE INDEX IF NOT EXISTS games_winner ON games (winner);
+
+CREATE TABLE IF NOT EXISTS rounds (
+    game_id TEXT NOT NULL,
+    round_num INTEGER NOT NULL,
+    started REAL,
+    ended REAL,
+    winner TEXT COLLATE NOCASE,
+    PRIMARY KEY (game_id, round_num)
+);
+CREATE INDEX IF NOT EXISTS rounds_winner ON rounds (winner);
+"""
+
+ADD_USER = ('INSERT INTO users (nick, username) VALUES (?, ?) '
+            'ON CONFLICT (nick) DO UPDATE SET username = excluded.username')
+
+# the columns top_players() may order by
+RANKINGS = ('points', 'games_won', 'games_played', 'games_started',
+            'games_joined')
+
+_stores = {}
+_lock = threading.Lock()
+
+
+class StatsStore(object):
+    # the most queued events written in one transaction
+    batch_size = 100
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.queue = queue.Queue()
+        db = sqlite3.connect(filename)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.executescript(SCHEMA)
+        db.commit()
+        db.close()
+        self.reader = None
+        self.writer = threading.Thread(target=self.write_behind,
+                                       name='stats', daemon=True)
+        self.writer.start()
+        # the writer is a daemon thread, so write out whatever is still
+        # queued before the interpreter exits
+        atexit.register(self.close)
+
+    #-----------------------------------------------------------------
+    # recording, all queued for the writer thread
+    #-----------------------------------------------------------------
+
+    def game_started(self, game_id, channel, nick=None, username=None):
+        statements = [('INSERT INTO games (id, channel, started) '
+                       'VALUES (?, ?, ?)', (game_id, channel, time.time()))]
+        if nick is not None:
+            statements.append((ADD_USER, (nick, username)))
+            statements.append(('UPDATE users SET games_started = '
+                               'games_started + 1 WHERE nick = ?', (nick,)))
+        self.put(statements)
+
+    def player_joined(self, game_id, nick, username):
+        self.put([(ADD_USER, (nick, username)),
+                  ('UPDATE users SET games_joined = games_joined + 1 '
+                   'WHERE nick = ?', (nick,))])
+
+    def round_started(self, game_id, round_num):
+        self.put([('INSERT OR REPLACE INTO rounds (game_id, round_num, '
+                   'started) VALUES (?, ?, ?)',
+                   (game_id, round_num, time.time())),
+                  ('UPDATE games SET rounds = ? WHERE id = ?',
+                   (round_num, game_id))])
+
+    def round_won(self, game_id, round_num, nick):
+        self.put([('UPDATE rounds SET ended = ?, winner = ? WHERE '
+                   'game_id = ? AND round_num = ?',
+                   (time.time(), nick, game_id, round_num)),
+                  ('UPDATE users SET points = points + 1 WHERE nick = ?',
+                   (nick,))])
+
+    def game_ended(self, game_id, winner, nicks):
+        """ winner is None if the game ended without one """
+        statements = [('UPDATE games SET ended = ?, winner = ? WHERE id = ?',
+                       (time.time(), winner, game_id))]
+        for nick in nicks:
+            statements.append(('UPDATE users SET games_played = '
+                               'games_played + 1 WHERE nick = ?', (nick,)))
+        if winner is not None:
+            statements.append(('UPDATE users SET games_won = games_won + 1 '
+                               'WHERE nick = ?', (winner,)))
+        self.put(statements)
+
+    def put(self, statements):
+        self.queue.put(statements)
+
+    def write_behind(self):
+        """ the writer thread: apply queued events in batches """
+        db = sqlite3.connect(self.filename)
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with db:
+                    for statements in batch:
+                        if statements is None:
+                            continue
+                        for sql, params in statements:
+                            db.execute(sql, params)
+            except sqlite3.Error as err:
+                logger.error('Unable to record stats: {}'.format(err))
+            for statements in batch:
+                self.queue.task_done()
+            if None in batch:
+                db.close()
+                return
+
+    def flush(self):
+        """ wait until everything queued so far has been written """
+        self.queue.join()
+
+    def close(self):
+        """ write everything queued and stop the writer thread """
+        if self.writer.is_alive():
+            self.queue.put(None)
+            self.writer.join()
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+    #-----------------------------------------------------------------
+    # queries
+    #-----------------------------------------------------------------
+
+    def top_players(self, num=5, ranking='points'):
+        """ list of (nick, value) for the num best players by ranking """
+        if ranking not in RANKINGS:
+            raise ValueError('cannot rank players by {}'.format(ranking))
+        if self.reader is None:
+            self.reader = sqlite3.connect(self.filename,
+                                          check_same_thread=False)
+        return self.reader.execute(
+            'SELECT nick, {0} FROM users WHERE {0} > 0 ORDER BY {0} DESC '
+            'LIMIT ?'.format(ranking), (num,)).fetchall()
+
+
+def get_store(filename):
+    """ the shared StatsStore for filename, or None if stats are off """
+    if not filename:
+        return None
+    key = os.path.abspath(filename)
+    with _lock:
+        if key not in _stores:
+            _stores[key] = StatsStore(filename)
+        return _stores[key]
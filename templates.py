@@ -0,0 +1,105 @@
+# vi: set expandtab ai:
+"""
+compiled versions of the text strings in config.yaml.  each string is
+parsed once when the config is loaded, its placeholders checked, and
+render() then fills it in without parsing the format string again.
+"""
+
+import string
+
+_formatter = string.Formatter()
+
+# the placeholders each text string may use; strings not listed here
+# may not use any.  a string that uses any other placeholder is a config
+# error, since the game can't supply it.  strings nested in a group are
+# listed as group.name.
+FIELDS = {
+    'answer_played': {'answer'},
+    'answers_timeout': {'players'},
+    'czar_pick': {'czar'},
+    'czar_timeout': {'czar'},
+    'game_resumed': {'round_num'},
+    'game_winner': {'player', 'points', 'scores'},
+    'idle_evicted': {'player'},
+    'pack_list': {'packs'},
+    'player_list': {'players'},
+    'player_hand': {'cards'},
+    'player_played': {'card'},
+    'question_announcement': {'card'},
+    'quit_message': {'player'},
+    'round_announcement': {'round_num', 'czar'},
+    'score_announcement': {'scores'},
+    'score_element': {'player', 'points', 'point_word'},
+    'status.wait_answers': {'players', 'question'},
+    'status.wait_czar': {'czar'},
+    'status.wait_players': {'num'},
+    'status_announcement': {'czar', 'players'},
+    'top_players': {'scores'},
+    'unknown_packs': {'packs'},
+    'winner_announcement': {'player', 'card', 'points'},
+    'welcome_join': {'name'},
+    'welcome_start': {'name'},
+    'welcome_wait': {'name', 'num', 'player_word'},
+}
+
+
+class Template(str):
+    """ a text string from the config.  it is still a str, so code that
+    calls .format() on it keeps working, but render() uses the pieces
+    parsed at load time, and strings with no placeholders are returned
+    as they are. """
+
+    def __new__(cls, text, key=None):
+        self = super().__new__(cls, text)
+        self.key = key
+        self.pieces = []
+        self.fields = set()
+        for literal, field, spec, conversion in _formatter.parse(text):
+            if field is not None:
+                if not field.isidentifier():
+                    raise ValueError('text {}: placeholder {{{}}} must be a '
+                                     'name'.format(key, field))
+                self.fields.add(field)
+            self.pieces.append((literal, field, spec, conversion))
+        allowed = FIELDS.get(key, frozenset())
+        if key is not None and not self.fields <= allowed:
+            raise ValueError('text {}: unknown placeholder(s) {}'.format(
+                key, ', '.join(sorted(self.fields - allowed))))
+        self.static = None if self.fields else str(text)
+        return self
+
+    def render(self, **kwargs):
+        if self.static is not None:
+            return self.static
+        out = []
+        for literal, field, spec, conversion in self.pieces:
+            out.append(literal)
+            if field is None:
+                continue
+            value = kwargs[field]
+            if conversion:
+                value = _formatter.convert_field(value, conversion)
+            out.append(format(value, spec) if spec else str(value))
+        return ''.join(out)
+
+
+class Catalog(dict):
+    """ the Templates for one language, keyed by text name.  nested
+    groups of strings (like 'status') are Catalogs themselves, whose
+    strings are checked as group.name. """
+
+    def __init__(self, texts, prefix=''):
+        super().__init__()
+        for key, text in texts.items():
+            if isinstance(text, dict):
+                self[key] = Catalog(text, prefix + key + '.')
+            else:
+                self[key] = Template(text, prefix + key)
+
+    def render(self, key, **kwargs):
+        return self[key].render(**kwargs)
+
+
+def compile_text(text):
+    """ compile the 'text' section of the config: a Catalog per language """
+    return {lang: Catalog(texts) for lang, texts in text.items()}
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# vi:set expandtab ai wm=0:
+
+"""
+memory benchmark for the card representation.  loads every card in
+carddir twice, once as the old dict-based Card (a per-instance __dict__
+with its own copy of the type and source strings) and once as the
+current slotted Card, and reports bytes per card for each.
+
+run from the top of the repo:  python test/cardmem.py
+"""
+
+import sys
+import json
+import tracemalloc
+
+sys.path.append('..')
+sys.path.append('.')
+
+import corpus
+from config import Config
+
+
+class DictCard(object):
+    """ the Card layout before __slots__ and interning """
+    def __init__(self, cardtype, value):
+        self.cardtype = cardtype
+        self.value = value
+        self.draw = 0
+        self.pick = 1
+        self.source = 'unknown'
+
+
+def load_dict_cards(carddir):
+    cards = []
+    for name in corpus.card_files(carddir):
+        with open('{}/{}'.format(carddir, name)) as fp:
+            for tmpcard in json.load(fp):
+                card = DictCard(tmpcard['type'], tmpcard['value'])
+                card.pick = tmpcard['pick']
+                card.draw = tmpcard['draw']
+                card.source = tmpcard['source']
+                cards.append(card)
+    return cards
+
+
+def load_slotted_cards(carddir, corpusfile):
+    return corpus.load(carddir, corpusfile)
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    cards = func(*args)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return cards, after - before
+
+
+def main():
+    config = Config().data
+    carddir = config['carddir']
+    corpusfile = config.get('corpusfile', 'cards.corpus')
+    # build the corpus first, so compiling it isn't counted
+    corpus.load(carddir, corpusfile)
+    old, old_bytes = measure(load_dict_cards, carddir)
+    new, new_bytes = measure(load_slotted_cards, carddir, corpusfile)
+    print('{} cards'.format(len(new)))
+    print('dict Card:    {:8d} bytes, {:6.1f} bytes/card'.format(
+          old_bytes, old_bytes / len(old)))
+    print('slotted Card: {:8d} bytes, {:6.1f} bytes/card'.format(
+          new_bytes, new_bytes / len(new)))
+
+
+if __name__ == '__main__':
+    main()
@@ -17,18 +17,38 @@ from unittest.mock import patch
 from unittest.mock import call
 import irc.client
 from shutil import copyfile
+import tempfile
+import sqlite3
+import json
 from random import randint
 
 sys.path.append('..')
 sys.path.append('.')
 
 from config import Config
+import config as configmod
 from card import Card
 from deck import Deck
 from player import Player
 from cmdparser import CmdParser
+import cmdparser
 from exceptions import (NotPermitted, NoMoreCards)
-from cahirc import IRCmsg, FakeIRCmsg
+from cahirc import IRCmsg, FakeIRCmsg, HeadlessIRC
+import corpus
+import cardpool
+import stats
+import snapshot
+import metrics
+import asynclog
+import queue
+import urllib.request
+import benchmark
+import timers
+import templates
+import sendqueue
+import asyncio
+import aiocahirc
+from deck import PoolDeck, CardStack
 
 from game import Game
 import game as gameclass
@@ -37,7 +57,7 @@ from game import irc as cahirc
 cahirc.Cahirc.say = MagicMock()
 cahirc.Cahirc.start = MagicMock()
 
-from pycardbot import setup_logging
+from pycardbot import setup_logging, receive_msg
 setup_logging()
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -81,12 +101,55 @@ class CardTest(unittest.TestCase):
         self.assertEqual('Test card', card.value)
 
     def test_card_info(self):
-        card = Card('Answer', 'Test card')
-        card.source = 'Test'
+        card = Card('Answer', 'Test card', source='Test')
         self.assertEqual('[Test] Answer: Test card (pick 1 draw 0)',
             card.info())
 
 
+    def test_question_is_presplit(self):
+        card = Card('Question', '%s and %s, forever.')
+        self.assertEqual(('', ' and ', ', forever.'), card.segments)
+        self.assertEqual(2, card.blanks)
+        self.assertEqual('___ and ___, forever.', card.formattedvalue)
+
+    def test_format_answer_fills_blanks(self):
+        game = Game()
+        game.question = Card('Question', '%s and %s.')
+        self.assertEqual('A and B.', game.format_answer(['A', 'B']))
+
+    def test_format_answer_appends_extra_answers(self):
+        game = Game()
+        game.question = Card('Question', 'Why {not} %s?')
+        self.assertEqual('Why {not} A? B C',
+                         game.format_answer([Card('Answer', 'A'),
+                                             Card('Answer', 'B'),
+                                             Card('Answer', 'C')]))
+
+    def test_format_answer_short_of_answers(self):
+        game = Game()
+        game.question = Card('Question', '%s and %s.')
+        self.assertEqual('A and ___.', game.format_answer(['A']))
+
+
+    def test_card_is_immutable(self):
+        card = Card('Answer', 'Test card')
+        with self.assertRaises(AttributeError):
+            card.value = 'Changed'
+        self.assertFalse(hasattr(card, '__dict__'))
+
+    def test_card_strings_are_interned(self):
+        source = ''.join(['Test', ' source'])
+        card1 = Card('Answer', 'Card 1', source=source)
+        card2 = Card('Answer', 'Card 2', source='Test source')
+        self.assertIs(card1.source, card2.source)
+
+    def test_with_id_copies_card(self):
+        card = Card('Question', '%s!', 2, 1, 'Test')
+        copy = card.with_id(7)
+        self.assertEqual(7, copy.id)
+        self.assertEqual(card.info(), copy.info())
+
+
 class DeckTest(unittest.TestCase):
     def test_deck_init_works(self):
         deck = Deck()
@@ -215,6 +278,320 @@ class DeckTest(unittest.TestCase):
         game.load_cards()
         self.assertEqual(num, len(game.deck.questioncards))
 
+class CorpusTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.carddir = os.path.join(self.tmpdir.name, 'cards')
+        self.corpusfile = os.path.join(self.tmpdir.name, 'cards.corpus')
+        os.mkdir(self.carddir)
+        self.write_cards('Test_a.json', [
+            {'type': 'Answer', 'value': 'Card 0', 'pick': 1, 'draw': 0,
+             'source': 'Test', 'keep': 'Yes'},
+            {'type': 'Answer', 'value': 'Cárd 1', 'pick': 1, 'draw': 0,
+             'source': 'Test', 'keep': 'Yes'}])
+        self.write_cards('Test_q.json', [
+            {'type': 'Question', 'value': '%s and %s', 'pick': 2,
+             'draw': 1, 'source': 'Other', 'keep': 'Yes'}])
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_cards(self, name, cards):
+        with open(os.path.join(self.carddir, name), 'w') as fp:
+            json.dump(cards, fp)
+
+    def test_load_matches_json(self):
+        cards = corpus.load(self.carddir, self.corpusfile)
+        self.assertEqual(['Card 0', 'Cárd 1', '%s and %s'],
+                         [card.value for card in cards])
+        question = cards[2]
+        self.assertEqual(('Question', 2, 1, 'Other'), (question.cardtype,
+                         question.pick, question.draw, question.source))
+
+    def test_load_builds_corpus_once(self):
+        corpus.load(self.carddir, self.corpusfile)
+        mtime = os.stat(self.corpusfile).st_mtime_ns
+        corpus.load(self.carddir, self.corpusfile)
+        self.assertEqual(mtime, os.stat(self.corpusfile).st_mtime_ns)
+
+    def test_changed_file_rebuilds_corpus(self):
+        corpus.load(self.carddir, self.corpusfile)
+        self.write_cards('Test_a.json', [
+            {'type': 'Answer', 'value': 'New card', 'pick': 1, 'draw': 0,
+             'source': 'Test', 'keep': 'Yes'}])
+        cards = corpus.load(self.carddir, self.corpusfile)
+        self.assertEqual(['New card', '%s and %s'],
+                         [card.value for card in cards])
+
+    def test_new_file_rebuilds_corpus(self):
+        corpus.load(self.carddir, self.corpusfile)
+        self.write_cards('More_a.json', [
+            {'type': 'Answer', 'value': 'More', 'pick': 1, 'draw': 0,
+             'source': 'More', 'keep': 'Yes'}])
+        cards = corpus.load(self.carddir, self.corpusfile)
+        self.assertEqual(4, len(cards))
+
+    def test_touched_file_is_not_stale(self):
+        corpus.load(self.carddir, self.corpusfile)
+        os.utime(os.path.join(self.carddir, 'Test_a.json'), (0, 0))
+        opened = corpus.Corpus(self.corpusfile)
+        self.assertFalse(corpus.is_stale(opened, self.carddir))
+        opened.close()
+
+    def test_pack_manifest(self):
+        self.write_cards('Other_a.json', [
+            {'type': 'Answer', 'value': 'Other', 'pick': 1, 'draw': 0,
+             'source': 'Other', 'keep': 'Yes'}])
+        opened = corpus.open_corpus(self.carddir, self.corpusfile)
+        self.assertEqual({'Other': [(0, 1)], 'Test': [(1, 2), (3, 1)]},
+                         opened.packs())
+        self.assertEqual(b'\x00\x00\x00\x01', opened.types())
+        self.assertEqual('%s and %s', opened.card(3, opened.sources()).value)
+        opened.close()
+
+    def test_lazy_pool_builds_cards_on_use(self):
+        pool = cardpool.CorpusPool(corpus.open_corpus(self.carddir,
+                                                      self.corpusfile))
+        self.assertEqual([None, None, None], pool.cards)
+        self.assertEqual((0, 1), pool.answers)
+        self.assertEqual('Question', pool.cardtype(2))
+        card = pool[1]
+        self.assertEqual('Cárd 1', card.value)
+        self.assertIs(card, pool[1])
+        self.assertIsNone(pool.cards[0])
+        self.assertEqual({'Test': 3}, pool.pack_sizes())
+
+    def test_repeated_cards_are_dealt_once(self):
+        self.write_cards('TestAmerica_a.json', [
+            {'type': 'Answer', 'value': 'card  0.', 'pick': 1, 'draw': 0,
+             'source': 'Test', 'keep': 'Yes'},
+            {'type': 'Answer', 'value': 'Card 2', 'pick': 1, 'draw': 0,
+             'source': 'Test', 'keep': 'Yes'}])
+        pool = cardpool.CorpusPool(corpus.open_corpus(self.carddir,
+                                                      self.corpusfile))
+        # TestAmerica_a.json is read first, so its copy of Card 0 is id 0
+        self.assertEqual([[0, 2]], pool.copies)
+        self.assertEqual([1, 2, 3, 4], pool.select())
+        self.assertEqual([1, 2, 3, 4], pool.select(prefer=['test']))
+        self.assertEqual([0, 1, 3, 4], pool.select(prefer=['xyzzy',
+                                                           'america']))
+        self.assertEqual([2, 3, 4], pool.select(['Test']))
+
+    def test_select_filters(self):
+        self.write_cards('Extra_a.json', [
+            {'type': 'Answer', 'value': 'Dropped', 'pick': 1, 'draw': 0,
+             'source': 'Extra', 'keep': 'No'}])
+        self.write_cards('Extra_q.json', [
+            {'type': 'Question', 'value': '%s, %s and %s', 'pick': 3,
+             'draw': 2, 'source': 'Extra', 'keep': 'Yes'}])
+        opened = corpus.open_corpus(self.carddir, self.corpusfile)
+        self.assertEqual(b'\x00\x01\x01\x01\x01', opened.column(corpus.KEEP))
+        self.assertEqual(4, len(corpus.load(self.carddir, self.corpusfile)))
+        pool = cardpool.CorpusPool(opened)
+        self.assertEqual((2, 3), pool.answers)
+        self.assertEqual([1, 2, 3, 4], pool.select())
+        self.assertEqual([2, 3, 4], pool.select(max_pick=2))
+        self.assertEqual([1], pool.select(['Extra']))
+        self.assertEqual([3, 4], pool.select(
+            ['Test'], predicates=[lambda card: card.value != 'Card 0']))
+
+    def test_normalize(self):
+        self.assertEqual(corpus.text_hash('Card 0'),
+                         corpus.text_hash(' CARD   0! '))
+        self.assertNotEqual(corpus.text_hash('Card 0'),
+                            corpus.text_hash('Card 1'))
+        self.assertEqual('cárd s and s', corpus.normalize('Cárd %s and %s.'))
+
+    def test_garbage_corpus_is_rebuilt(self):
+        with open(self.corpusfile, 'wb') as fp:
+            fp.write(b'garbage')
+        cards = corpus.load(self.carddir, self.corpusfile)
+        self.assertEqual(3, len(cards))
+
+
+class CardPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = cardpool.CardPool([Card('Answer', 'Card 0'),
+                                       Card('Question', 'Question 0'),
+                                       Card('Answer', 'Card 1'),
+                                       Card('Answer', 'Card 2')])
+
+    def test_pool_assigns_ids(self):
+        self.assertEqual([0, 1, 2, 3], [card.id for card in self.pool.cards])
+        self.assertEqual((0, 2, 3), self.pool.answers)
+        self.assertEqual((1,), self.pool.questions)
+
+    def test_get_pool_is_shared(self):
+        config = Config().data
+        pool = cardpool.get_pool(config['carddir'], config['corpusfile'])
+        self.assertIs(pool, cardpool.get_pool(config['carddir'],
+                                              config['corpusfile']))
+
+    def test_games_share_pool_cards(self):
+        game1 = Game()
+        game2 = Game()
+        game1.load_cards()
+        game2.load_cards()
+        self.assertIs(game1.deck.pool, game2.deck.pool)
+        self.assertIs(game1.deck.answercards[0], game2.deck.answercards[0])
+
+    def test_pool_deck_holds_ids(self):
+        deck = PoolDeck(self.pool)
+        self.assertEqual([0, 2, 3], deck.answerids)
+        self.assertEqual([1], deck.questionids)
+
+    def test_pool_deck_deals_pool_cards(self):
+        deck = PoolDeck(self.pool)
+        self.assertIs(self.pool[3], deck.deal('Answer'))
+        self.assertIs(self.pool[0], deck.deal('Answer', 0))
+        self.assertEqual([self.pool[2]], deck.answercards)
+        self.assertEqual([3, 0], deck.dealt_answerids)
+
+    def test_pool_deck_empty_question_fails(self):
+        deck = PoolDeck(self.pool)
+        deck.deal('Question')
+        with self.assertRaises(NoMoreCards):
+            deck.deal('Question')
+
+    def test_pool_deck_undeal_and_reset(self):
+        deck = PoolDeck(self.pool)
+        deck.deal('Answer')
+        deck.deal('Answer')
+        deck.undeal_last('Answer')
+        self.assertEqual(2, len(deck.answerids))
+        deck.deal('Question')
+        deck.reset()
+        self.assertEqual(4, len(deck))
+        self.assertEqual([], deck.dealt_answers)
+
+    def test_match_packs(self):
+        pool = Game().card_pool()
+        packs, unmatched = pool.match_packs(['base', 'Harry_Potter', 'xyzzy'])
+        self.assertEqual(['OfficialBaseSet', 'OfficialBaseSetAmerica',
+                          'harry_potter'], packs)
+        self.assertEqual(['xyzzy'], unmatched)
+        self.assertEqual(['OfficialBaseSet'],
+                         pool.match_packs(['officialbaseset'])[0])
+
+    def test_start_with_packs(self):
+        game = Game()
+        run_command(game, 'start christmas', user='Bob!~bobbo@127.0.0.1')
+        self.assertEqual(['OfficialChristmasExpansion'],
+                         game.selected_packs)
+        sources = {card.source for card in game.deck.answercards +
+                   game.deck.questioncards}
+        pool = game.card_pool()
+        self.assertEqual(pool.pack_sizes()['OfficialChristmasExpansion'],
+                         len(game.deck))
+        self.assertEqual(1, len(sources))
+
+    def test_start_with_unknown_pack(self):
+        game = Game()
+        run_command(game, 'start nonesuch', user='Bob!~bobbo@127.0.0.1')
+        self.assertEqual('inactive', game.status)
+        expected = call(game.render('unknown_packs', packs='nonesuch'))
+        self.assertEqual(str(expected), str(cahirc.Cahirc.say.mock_calls[-1]))
+
+    def test_packs_command(self):
+        game = Game()
+        run_command(game, 'packs')
+        text = str(cahirc.Cahirc.say.mock_calls[-1])
+        self.assertIn('harry_potter (', text)
+
+    def test_start_uses_prefetched_deck(self):
+        game = Game()
+        packs, deck = game.next_deck.result()
+        game.start()
+        self.assertIs(deck, game.deck)
+        self.assertIsNotNone(game.next_deck)
+        self.assertIsNot(deck, game.next_deck.result()[1])
+
+    def test_prefetch_for_other_packs_is_not_used(self):
+        game = Game()
+        packs, deck = game.next_deck.result()
+        run_command(game, 'start christmas', user='Bob!~bobbo@127.0.0.1')
+        self.assertIsNot(deck, game.deck)
+        self.assertEqual(['OfficialChristmasExpansion'],
+                         game.next_deck.result()[0])
+
+    def test_pool_deck_subset(self):
+        deck = PoolDeck(self.pool, [0, 1])
+        self.assertEqual(['Card 0'], deck.show_hand('Answer'))
+        self.assertEqual(['Question 0'], deck.show_hand('Question'))
+
+
+class CardStackTest(unittest.TestCase):
+    def test_deal_moves_cursor(self):
+        stack = CardStack([0, 1, 2, 3])
+        self.assertEqual(3, stack.deal())
+        self.assertEqual(3, len(stack))
+        self.assertEqual([3], stack.dealt())
+
+    def test_deal_by_index_keeps_order(self):
+        stack = CardStack([5, 6, 7, 8])
+        self.assertEqual(6, stack.deal(1))
+        self.assertEqual([5, 7, 8], stack.available())
+        self.assertEqual(8, stack.deal(-1))
+        self.assertEqual([6, 8], stack.dealt())
+
+    def test_deal_from_empty_stack_fails(self):
+        stack = CardStack([])
+        with self.assertRaises(IndexError):
+            stack.deal()
+
+    def test_undeal_and_reset(self):
+        stack = CardStack([0, 1, 2])
+        stack.deal()
+        stack.deal()
+        stack.undeal_last()
+        self.assertEqual([0, 1], stack.available())
+        stack.reset()
+        self.assertEqual(3, len(stack))
+        self.assertEqual([], stack.dealt())
+
+    def test_add_goes_on_top(self):
+        stack = CardStack([0, 1])
+        stack.deal()
+        stack.add(9)
+        self.assertEqual(9, stack.deal())
+        self.assertEqual([1, 9], stack.dealt())
+
+    def test_add_keeps_dealt_order(self):
+        stack = CardStack([0, 1, 2, 3])
+        stack.deal()
+        stack.deal()
+        stack.add(9)
+        self.assertEqual([3, 2], stack.dealt())
+        stack.undeal_last()
+        self.assertEqual([0, 1, 9, 2], stack.available())
+
+    def test_shuffle_keeps_dealt_cards(self):
+        stack = CardStack(range(20))
+        stack.deal()
+        stack.shuffle()
+        self.assertEqual(list(range(19)), sorted(stack.available()))
+        self.assertEqual([19], stack.dealt())
+
+    def test_recycle_skips_cards_in_hand(self):
+        stack = CardStack(range(5))
+        dealt = [stack.deal() for i in range(4)]
+        stack.discard(dealt[0])
+        stack.discard(dealt[2])
+        self.assertEqual(2, stack.recycle())
+        self.assertEqual(sorted([0, dealt[0], dealt[2]]),
+                         sorted(stack.available()))
+        self.assertEqual(sorted([dealt[1], dealt[3]]), sorted(stack.dealt()))
+
+    def test_recycle_keeps_dealt_order(self):
+        stack = CardStack(range(6))
+        self.assertEqual([5, 4, 3], [stack.deal() for i in range(3)])
+        stack.discard(5)
+        self.assertEqual(1, stack.recycle())
+        self.assertEqual([4, 3], stack.dealt())
+        stack.undeal_last()
+        self.assertEqual(3, stack.deal())
+
+
 class PlayerTest(unittest.TestCase):
     def test_create_player_works(self):
         player = Player('Bob', '~bobbo')
@@ -231,6 +608,10 @@ class PlayerTest(unittest.TestCase):
         player.game_win()
         self.assertEqual((0, 1, 1), player.get_score())
 
+    def test_player_is_slotted(self):
+        player = Player('Bob', '~bobbo')
+        self.assertFalse(hasattr(player, '__dict__'))
+
     def test_show_hand_works(self):
         cards = []
         cards.append(Card('Answer', 'Card 0'))
@@ -263,7 +644,8 @@ class PlayerTest(unittest.TestCase):
         game = start_game()
         new_player = Player('Ann', '~anno')
         run_command(game, 'join', user=new_player)
-        self.assertEqual(game.config['hand_size'], len(game.players[-1].deck))
+        self.assertEqual(game.config['hand_size'] + game.question.draw,
+                         len(game.players[-1].deck))
         text = 'Your cards are'
         self.assertTrue(re.search(text, str(cahirc.Cahirc.say.mock_calls[-1])))
 
@@ -304,7 +686,8 @@ class GameTest(unittest.TestCase):
         game.add_player(joe)
         p.parse(msg)
         game.command(p)
-        self.assertEqual(hand_size - 1, len(jim.show_hand()))
+        self.assertEqual(hand_size + game.question.draw - 1,
+                         len(jim.show_hand()))
 
     def test_winner_announcement(self):
         config = Config().data
@@ -470,6 +853,40 @@ class GamePlayerTest(unittest.TestCase):
         self.assertEqual(1, len(game.players))
 
 
+class PlayerRegistryTest(unittest.TestCase):
+    def test_get_player_folds_case(self):
+        game = start_game()
+        self.assertIs(game.players[0], game.get_player('BOB'))
+        self.assertIsNone(game.get_player('Nobody'))
+
+    def test_same_nick_is_a_double_join(self):
+        game = Game()
+        game.add_player(Player('Bob', '~bobbo'))
+        game.add_player(Player('bob', '~other'))
+        self.assertEqual(1, len(game.players))
+
+    def test_quit_before_czar_keeps_czar(self):
+        game = start_game()
+        game.next_czar()
+        czar = game.czar
+        run_command(game, 'quit', user=game.players[0])
+        self.assertIs(czar, game.czar)
+
+    def test_last_czar_quitting_wraps(self):
+        game = start_game()
+        game.next_czar()
+        game.next_czar()
+        run_command(game, 'quit', user=game.czar)
+        self.assertIs(game.players[0], game.czar)
+
+    def test_quit_unregisters_nick(self):
+        game = start_game()
+        bob = game.players[0]
+        run_command(game, 'quit', user=bob)
+        self.assertIsNone(game.get_player('Bob'))
+        self.assertNotIn(bob, game.players)
+
+
 class PlayTest(unittest.TestCase):
     def test_game_serves_question_card(self):
         game = Game()
@@ -492,9 +909,9 @@ class PlayTest(unittest.TestCase):
         game.add_player(bob)
         game.add_player(joe)
         game.add_player(jim)
-        self.assertEqual(10, len(bob.show_hand()))
-        self.assertEqual(10, len(joe.show_hand()))
-        self.assertEqual(10, len(jim.show_hand()))
+        for player in (bob, joe, jim):
+            draw = 0 if player is game.czar else game.question.draw
+            self.assertEqual(10 + draw, len(player.show_hand()))
 
     def test_czar_answer_not_accepted(self):
         game = start_game()
@@ -524,7 +941,8 @@ class PlayTest(unittest.TestCase):
         game = start_game()
         jim = game.players[2]
         num_cards = game.question.pick
-        remaining = Config().data['hand_size'] - num_cards
+        remaining = (Config().data['hand_size'] + game.question.draw -
+                     num_cards)
         nums = ' '.join([str(i) for i in range(num_cards)])
         run_command(game, f'pick {nums}', user=jim)
         run_command(game, f'pick {nums}', user=jim)
@@ -699,8 +1117,10 @@ class CardsCmdTest(unittest.TestCase):
         for card in hand:
             handstring += '[{}] {} '.format(i, card)
             i += 1
-        expected = call(annc.format(cards=handstring))
-        self.assertIn(str(expected), str(cahirc.Cahirc.say.mock_calls[-1]))
+        # a hand too long for one IRC line is sent as several lines
+        sent = cahirc.Cahirc.say.mock_calls[-1].args[0]
+        self.assertEqual(annc.format(cards=handstring),
+                         sent.replace('\n', ''))
         self.assertEqual(player.nick, game.irc.destination)
 
 
@@ -982,6 +1402,126 @@ class ParserTest(unittest.TestCase):
         self.assertEqual(0, len(cahirc.Cahirc.say.mock_calls))
 
 
+class ParserReuseTest(unittest.TestCase):
+    def setUp(self):
+        cahirc.Cahirc.say.reset_mock()
+
+    def test_might_be_command(self):
+        self.assertTrue(cmdparser.might_be_command('play 1 2'))
+        self.assertTrue(cmdparser.might_be_command('shame'))
+        self.assertFalse(cmdparser.might_be_command('hello there'))
+        self.assertFalse(cmdparser.might_be_command('   '))
+
+    def test_chatter_is_not_parsed(self):
+        game = Game()
+        game.cmdparser.parse = MagicMock()
+        receive_msg(game, FakeIRCmsg('nothing to see here'))
+        game.cmdparser.parse.assert_not_called()
+
+    def test_game_reuses_parser(self):
+        game = Game()
+        parser = game.cmdparser
+        receive_msg(game, FakeIRCmsg('start'))
+        receive_msg(game, FakeIRCmsg('join', user='Joe!~joe@127.0.0.1'))
+        self.assertIs(parser, game.cmdparser)
+        self.assertEqual(2, len(game.players))
+
+    def test_parse_resets_state(self):
+        game = start_game()
+        parser = CmdParser(game)
+        parser.parse(FakeIRCmsg('winner 1', user=game.players[0]))
+        self.assertEqual([1], parser.args)
+        parser.parse(FakeIRCmsg('score', user=game.players[0]))
+        self.assertEqual('score', parser.command)
+        self.assertEqual([], parser.args)
+
+    def test_command_table_is_shared(self):
+        self.assertIs(CmdParser(None).cmdattrs, CmdParser(None).cmdattrs)
+
+    def test_played_cards_leave_hand(self):
+        game = start_game()
+        jim = game.players[2]
+        hand = jim.show_hand()
+        run_command(game, 'play 0 1', user=jim)
+        self.assertEqual(hand[2:], jim.show_hand())
+
+
+class AliasTest(unittest.TestCase):
+    def test_state_specific_alias(self):
+        self.assertEqual('winner', cmdparser.resolve_alias('pick',
+                                                           'wait_czar'))
+        self.assertEqual('play', cmdparser.resolve_alias('pick',
+                                                         'wait_answers'))
+
+    def test_non_alias_resolves_to_itself(self):
+        self.assertEqual('join', cmdparser.resolve_alias('join', 'inactive'))
+
+    def test_any_alias_hides_later_entries(self):
+        try:
+            cmdparser.add_alias('boot', 'quit')
+            cmdparser.add_alias('boot', 'score', 'wait_czar')
+            self.assertEqual('quit', cmdparser.resolve_alias('boot',
+                                                             'wait_czar'))
+            self.assertTrue(cmdparser.might_be_command('boot'))
+        finally:
+            del cmdparser.ALIASES[-2:]
+            cmdparser.compile_commands()
+        self.assertFalse(cmdparser.might_be_command('boot'))
+
+    def test_alias_resolved_once_per_message(self):
+        game = Game()
+        parser = CmdParser(game)
+        with patch('cmdparser.resolve_alias',
+                   wraps=cmdparser.resolve_alias) as resolve:
+            parser.parse(FakeIRCmsg('players'))
+        self.assertEqual('list', parser.command)
+        self.assertEqual(1, resolve.call_count)
+
+
+class TemplateTest(unittest.TestCase):
+    def test_render_matches_format(self):
+        text = templates.Template('{player} has {points:>3} points',
+                                  'score_element')
+        self.assertEqual(text.format(player='Bob', points=2),
+                         text.render(player='Bob', points=2))
+        self.assertEqual({'player', 'points'}, text.fields)
+
+    def test_static_text_is_cached(self):
+        text = templates.Template('Hello there', 'help_blurb')
+        self.assertIs(text.render(), text.render())
+        self.assertIs(str, type(text.render()))
+
+    def test_unknown_placeholder_is_rejected(self):
+        with self.assertRaises(ValueError):
+            templates.Template('{playr} has left', 'quit_message')
+
+    def test_placeholder_in_unlisted_text_is_rejected(self):
+        with self.assertRaises(ValueError):
+            templates.Template('Bye {nick}!', 'shutdown_message')
+        with self.assertRaises(ValueError):
+            templates.Catalog({'status': {'inactive': 'No {game}'}})
+
+    def test_positional_placeholder_is_rejected(self):
+        with self.assertRaises(ValueError):
+            templates.Template('{} has left', 'quit_message')
+
+    def test_catalog_nests(self):
+        catalog = templates.Catalog({'status': {'wait_czar': 'Hi {czar}'}})
+        self.assertEqual('Hi Bob',
+                         catalog['status'].render('wait_czar', czar='Bob'))
+
+    def test_config_text_compiles(self):
+        config = Config()
+        self.assertIsInstance(config.text['en']['help_blurb'],
+                              templates.Template)
+
+    def test_game_renders_text(self):
+        game = Game()
+        self.assertEqual(
+            game.config['text']['en']['quit_message'].format(player='Bob'),
+            game.render('quit_message', player='Bob'))
+
+
 class ConfigTest(unittest.TestCase):
     def test_config_exists_at_all(self):
         config = Config()
@@ -991,6 +1531,31 @@ class ConfigTest(unittest.TestCase):
         config = Config()
         self.assertEqual('cards', config.data['carddir'])
 
+    def test_config_files_are_parsed_once(self):
+        one = Config()
+        two = Config()
+        self.assertIsNot(one.data, two.data)
+        self.assertIs(one.text, two.text)
+        one.data['max_idle'] = 99
+        self.assertNotEqual(99, Config().data['max_idle'])
+
+    def test_changed_config_is_reread(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'config.yaml')
+            with open(filename, 'w') as fp:
+                fp.write('max_points: 5\n')
+            config = Config()
+            config.path = [tmpdir]
+            config.reload()
+            self.assertEqual(5, config.data['max_points'])
+            first = configmod.load_file(filename)
+            self.assertIs(first[0], configmod.load_file(filename)[0])
+            with open(filename, 'w') as fp:
+                fp.write('max_points: 15\n')
+            os.utime(filename, ns=(0, 0))
+            config.reload()
+            self.assertEqual(15, config.data['max_points'])
+
 
 class BasicIRCTest(unittest.TestCase):
     def setUp(self):
@@ -1121,9 +1686,9 @@ class GameIRCTest(unittest.TestCase):
         msg = FakeIRCmsg('join', user=joe)
         p.parse(msg)
         game.command(p)
-        self.assertEqual(10, len(game.players[0].show_hand()))
-        self.assertEqual(10, len(game.players[1].show_hand()))
-        self.assertEqual(10, len(game.players[2].show_hand()))
+        for player in game.players:
+            draw = 0 if player is game.czar else game.question.draw
+            self.assertEqual(10 + draw, len(player.show_hand()))
 
     def test_first_question_displays(self):
         config = Config().data
@@ -1239,9 +1804,10 @@ class GameIRCTest(unittest.TestCase):
         run_command(game, f'pick {cardslist}', user=game.players[1])
         run_command(game, f'pick {cardslist}', user=game.players[2])
         run_command(game, 'winner 0', user=game.players[0])
-        for i in range(3):
-            self.assertEqual(10, len(game.players[i].deck))
         self.assertEqual(game.players[1], game.czar)
+        for player in game.players:
+            draw = 0 if player is game.czar else game.question.draw
+            self.assertEqual(10 + draw, len(player.deck))
 
     def test_non_czar_cannot_pick_winner(self):
         game = start_game()
@@ -1314,6 +1880,817 @@ class GameIRCTest(unittest.TestCase):
         self.assertEqual(expected, str(cahirc.Cahirc.say.mock_calls[-1]))
 
 
+class MultiChannelTest(unittest.TestCase):
+    def setUp(self):
+        self.bot = cahirc.Cahirc()
+        self.bot.connection = MagicMock()
+        self.one = Game('#one', self.bot)
+        self.two = Game('#two', self.bot)
+
+    def event(self, text, target, user='Bob!~bobbo@127.0.0.1',
+              kind='pubmsg'):
+        return irc.client.Event(kind, irc.client.NickMask(user), target,
+                                [text])
+
+    def test_games_are_registered(self):
+        self.assertIs(self.one, self.bot.games['#one'])
+        self.assertIs(self.two, self.bot.games['#TWO'])
+        self.assertIs(self.one, self.bot.game)
+
+    def test_pubmsg_goes_to_channel_game(self):
+        self.bot.on_pubmsg(self.bot.connection, self.event('start', '#Two'))
+        self.assertEqual('wait_players', self.two.status)
+        self.assertEqual('inactive', self.one.status)
+        self.assertEqual('#two',
+                         self.bot.connection.privmsg.mock_calls[0][1][0])
+
+    def test_privmsg_goes_to_players_game(self):
+        self.bot.on_pubmsg(self.bot.connection, self.event('start', '#two'))
+        self.assertIs(self.two, self.bot.find_game(
+                      self.event('state', 'pycardbot', kind='privmsg')))
+        self.assertIs(self.one, self.bot.find_game(
+                      self.event('state', 'pycardbot', user='Al!~al@host',
+                                 kind='privmsg')))
+
+    def test_unknown_channel_is_ignored(self):
+        self.bot.on_pubmsg(self.bot.connection, self.event('start', '#x'))
+        self.bot.connection.privmsg.assert_not_called()
+
+    def test_games_share_connection(self):
+        self.assertIs(self.one.irc.bot, self.two.irc.bot)
+        self.one.irc.say('hello')
+        self.two.irc.say('there')
+        self.assertEqual([call('#one', 'hello'), call('#two', 'there')],
+                         self.bot.connection.privmsg.mock_calls)
+
+    def test_shutdown_says_goodbye_everywhere(self):
+        self.bot.die = MagicMock()
+        self.bot.shutdown('bye')
+        self.assertEqual([call('#one', 'bye'), call('#two', 'bye')],
+                         self.bot.connection.privmsg.mock_calls)
+        self.bot.die.assert_called_once_with('Shutting down')
+
+    def test_shutdown_drains_rate_limited_queue(self):
+        self.bot.queue = sendqueue.SendQueue(rate=1, burst=2,
+                                             clock=lambda: 0)
+        channels = ['#one', '#two'] + ['#c{}'.format(i) for i in range(5)]
+        for channel in channels[2:]:
+            Game(channel, self.bot)
+        self.bot.die = MagicMock()
+        self.bot.shutdown('bye')
+        self.assertEqual([call(channel, 'bye') for channel in channels],
+                         self.bot.connection.privmsg.mock_calls)
+        self.assertEqual(0, len(self.bot.queue))
+        self.bot.die.assert_called_once_with('Shutting down')
+
+
+class SendQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.queue = sendqueue.SendQueue(rate=1, burst=2,
+                                         clock=lambda: self.now)
+
+    def test_burst_then_rate_limit(self):
+        for i in range(3):
+            self.queue.put('nick{}'.format(i), 'line')
+        self.assertEqual(('nick0', 'line'), self.queue.get())
+        self.assertEqual(('nick1', 'line'), self.queue.get())
+        self.assertIsNone(self.queue.get())
+        self.assertEqual(1, self.queue.delay())
+        self.now = 1
+        self.assertEqual(('nick2', 'line'), self.queue.get())
+        self.assertIsNone(self.queue.get())
+
+    def test_waiting_lines_are_coalesced(self):
+        self.queue.put('#test', 'one')
+        self.queue.put('#test', 'two')
+        self.queue.put('Bob', 'three', sendqueue.PRIVATE)
+        self.assertEqual(2, len(self.queue))
+        self.assertEqual(('#test', 'one | two'), self.queue.get())
+
+    def test_coalescing_respects_line_limit(self):
+        limit = sendqueue.message_limit('#test')
+        self.queue.put('#test', 'x' * (limit - 5))
+        self.queue.put('#test', 'y' * 5)
+        self.assertEqual(2, len(self.queue))
+
+    def test_channel_lines_go_first(self):
+        self.queue.put('Bob', 'hand', sendqueue.PRIVATE)
+        self.queue.put('#test', 'announcement', sendqueue.CHANNEL)
+        self.assertEqual(('#test', 'announcement'), self.queue.get())
+        self.assertEqual(('Bob', 'hand'), self.queue.get())
+
+    def test_bot_schedules_flush_when_limited(self):
+        bot = cahirc.Cahirc()
+        bot.connection = MagicMock()
+        bot.reactor = MagicMock()
+        bot.queue = self.queue
+        for i in range(3):
+            bot.send('#test{}'.format(i), 'line')
+        self.assertEqual(2, len(bot.connection.privmsg.mock_calls))
+        bot.reactor.scheduler.execute_after.assert_called_once_with(
+            1, bot.flush)
+        self.now = 1
+        bot.flush()
+        self.assertEqual(call('#test2', 'line'),
+                         bot.connection.privmsg.mock_calls[-1])
+
+
+class AioCahircTest(unittest.TestCase):
+    def setUp(self):
+        self.bot = aiocahirc.AioCahirc()
+        self.bot.connection = MagicMock()
+        self.game = Game('#aio', self.bot)
+
+    def tearDown(self):
+        self.bot.executor.shutdown()
+        self.bot.loop.close()
+
+    def test_pubmsg_goes_to_game(self):
+        event = irc.client.Event('pubmsg',
+                                 irc.client.NickMask('Bob!~bobbo@host'),
+                                 '#aio', ['start'])
+        self.bot.on_pubmsg(self.bot.connection, event)
+        self.assertEqual('wait_players', self.game.status)
+        self.assertEqual('#aio',
+                         self.bot.connection.privmsg.mock_calls[0][1][0])
+
+    def test_offload_runs_in_thread(self):
+        future = self.bot.offload(sum, [1, 2, 3])
+        self.assertIsInstance(future, asyncio.Future)
+        self.assertEqual(6, self.bot.loop.run_until_complete(future))
+
+    def test_flush_scheduled_on_loop(self):
+        self.bot.queue = sendqueue.SendQueue(rate=100, burst=1)
+        self.game.irc.say('one')
+        self.game.irc.say('two')
+        self.assertEqual(1, len(self.bot.connection.privmsg.mock_calls))
+        self.bot.loop.run_until_complete(asyncio.sleep(0.05))
+        self.assertEqual(call('#aio', 'two'),
+                         self.bot.connection.privmsg.mock_calls[-1])
+
+
+class StatsTest(unittest.TestCase):
+    def setUp(self):
+        cahirc.Cahirc.say.reset_mock()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = stats.StatsStore(os.path.join(self.tmpdir.name,
+                                                   'stats.db'))
+
+    def tearDown(self):
+        self.store.close()
+        self.tmpdir.cleanup()
+
+    def test_store_is_closed_at_exit(self):
+        with patch('atexit.register') as register:
+            store = stats.StatsStore(os.path.join(self.tmpdir.name, 'x.db'))
+        register.assert_called_once_with(store.close)
+        store.game_started('g1', '#test', 'Bob', '~bobbo')
+        store.close()
+        store.close()
+        self.assertFalse(store.writer.is_alive())
+        db = sqlite3.connect(store.filename)
+        self.assertEqual(1, db.execute('SELECT COUNT(*) FROM games')
+                         .fetchone()[0])
+        db.close()
+
+    def query(self, sql, params=()):
+        self.store.flush()
+        db = sqlite3.connect(self.store.filename)
+        rows = db.execute(sql, params).fetchall()
+        db.close()
+        return rows
+
+    def play_game(self):
+        game = Game()
+        game.stats = self.store
+        bob = Player('Bob', '~bobbo')
+        game.start(bob)
+        game.add_player(Player('Joe', '~joebo'))
+        game.add_player(Player('Jim', '~jimbo'))
+        return game
+
+    def test_round_is_recorded(self):
+        game = self.play_game()
+        pick_answers(game, game.players[1])
+        pick_answers(game, game.players[2])
+        run_command(game, 'winner 0', user=game.players[0])
+        rows = self.query('SELECT round_num, winner FROM rounds '
+                          'WHERE ended IS NOT NULL')
+        self.assertEqual(1, len(rows))
+        self.assertIn(rows[0][1], ['Joe', 'Jim'])
+        self.assertEqual([(rows[0][1], 1)], self.store.top_players())
+
+    def test_game_counts_are_recorded(self):
+        game = self.play_game()
+        game.end_game(game.players[1])
+        rows = self.query('SELECT nick, games_started, games_joined, '
+                          'games_played, games_won FROM users ORDER BY nick')
+        self.assertEqual([('Bob', 1, 1, 1, 0), ('Jim', 0, 1, 1, 0),
+                          ('Joe', 0, 1, 1, 1)], rows)
+        self.assertEqual([('Joe',)],
+                         self.query('SELECT winner FROM games'))
+
+    def test_recording_does_not_wait_for_database(self):
+        db = sqlite3.connect(self.store.filename)
+        db.execute('BEGIN EXCLUSIVE')
+        self.store.round_started('game', 1)
+        self.store.round_won('game', 1, 'Joe')
+        self.assertEqual(2, self.store.queue.unfinished_tasks)
+        db.rollback()
+        db.close()
+        self.assertEqual([('Joe',)],
+                         self.query('SELECT winner FROM rounds'))
+
+    def test_top_command(self):
+        game = self.play_game()
+        self.store.round_won(game.game_id, 1, 'Joe')
+        self.store.flush()
+        run_command(game, 'top')
+        self.assertIn('Joe with 1 point', str(cahirc.Cahirc.say.mock_calls[-1]))
+
+    def test_top_command_without_stats(self):
+        game = Game()
+        game.stats = None
+        run_command(game, 'top')
+        self.assertEqual(str(call(game.render('stats_disabled'))),
+                         str(cahirc.Cahirc.say.mock_calls[-1]))
+
+    def test_bad_ranking_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.store.top_players(ranking='nick; DROP TABLE users')
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def journalled_game(self):
+        game = Game()
+        game.journal = snapshot.Journal(self.tmpdir.name, game.channel)
+        return game
+
+    def start_journalled_game(self):
+        game = self.journalled_game()
+        run_command(game, 'start', user='Bob!~bobbo@127.0.0.1')
+        run_command(game, 'join', user='Joe!~joebo@127.0.0.1')
+        run_command(game, 'join', user='Jim!~jimbo@127.0.0.1')
+        return game
+
+    def test_game_resumes_from_journal(self):
+        game = self.start_journalled_game()
+        pick_answers(game, game.players[1])
+        restored = self.journalled_game()
+        restored.resume()
+        self.assertEqual('wait_answers', restored.status)
+        self.assertEqual(game.round_num, restored.round_num)
+        self.assertIs(game.question, restored.question)
+        self.assertEqual([p.nick for p in game.players],
+                         [p.nick for p in restored.players])
+        self.assertEqual(game.players[2].show_hand(),
+                         restored.players[2].show_hand())
+        self.assertEqual(game.deck.answerids, restored.deck.answerids)
+        self.assertEqual(game.deck.dealt_answerids,
+                         restored.deck.dealt_answerids)
+        joe = restored.get_player('Joe')
+        self.assertEqual(game.answers[game.players[1]]['cards'],
+                         restored.answers[joe]['cards'])
+
+    def test_resumed_game_plays_on(self):
+        game = self.start_journalled_game()
+        restored = self.journalled_game()
+        restored.resume()
+        pick_answers(restored, restored.players[1])
+        pick_answers(restored, restored.players[2])
+        self.assertEqual('wait_czar', restored.status)
+        run_command(restored, 'winner 0', user=restored.players[0])
+        self.assertEqual(2, restored.round_num)
+
+    def test_partial_line_is_ignored(self):
+        game = self.start_journalled_game()
+        with open(game.journal.filename, 'a') as fp:
+            fp.write('{"version": 2, "po')
+        self.assertEqual(game.round_num, game.journal.latest()['round'])
+
+    def test_journal_is_compacted(self):
+        journal = snapshot.Journal(self.tmpdir.name, '#small')
+        journal.compact_every = 3
+        for i in range(5):
+            journal.write({'round': i})
+        with open(journal.filename) as fp:
+            self.assertEqual(2, len(fp.readlines()))
+        self.assertEqual(4, journal.latest()['round'])
+
+    def test_ended_game_clears_journal(self):
+        game = self.start_journalled_game()
+        self.assertTrue(os.path.exists(game.journal.filename))
+        for player in list(game.players):
+            run_command(game, 'quit', user=player)
+        self.assertFalse(os.path.exists(game.journal.filename))
+
+    def test_resume_after_player_quit(self):
+        game = self.start_journalled_game()
+        run_command(game, 'join', user='Ann!~annie@127.0.0.1')
+        joe = game.get_player('Joe')
+        if joe is game.czar:
+            joe = game.get_player('Ann')
+        pick_answers(game, joe)
+        run_command(game, 'quit', user=joe)
+        restored = self.journalled_game()
+        restored.resume()
+        self.assertEqual('wait_answers', restored.status)
+        self.assertEqual([p.nick for p in game.players],
+                         [p.nick for p in restored.players])
+        self.assertEqual([joe.nick], [p.nick for p in restored.answers])
+        self.assertIsNone(restored.get_player(joe.nick))
+
+    def test_damaged_snapshot_is_not_resumed(self):
+        game = self.start_journalled_game()
+        state = game.journal.latest()
+        del state['layout']
+        del state['players'][0][5]
+        with open(game.journal.filename, 'a') as fp:
+            fp.write(json.dumps(state) + '\n')
+        restored = self.journalled_game()
+        restored.resume()
+        self.assertEqual('inactive', restored.status)
+        self.assertEqual([], restored.players)
+        self.assertFalse(os.path.exists(restored.journal.filename))
+
+    def damage(self, game, field, value):
+        """ append a copy of the latest snapshot with field set to value """
+        state = game.journal.latest()
+        del state['layout']
+        state[field] = value
+        with open(game.journal.filename, 'a') as fp:
+            fp.write(json.dumps(state) + '\n')
+
+    def test_unknown_status_is_not_resumed(self):
+        game = self.start_journalled_game()
+        self.damage(game, 'status', 'dancing')
+        restored = self.journalled_game()
+        restored.resume()
+        self.assertEqual('inactive', restored.status)
+        self.assertFalse(os.path.exists(restored.journal.filename))
+
+    def test_czar_out_of_range_is_not_resumed(self):
+        game = self.start_journalled_game()
+        self.damage(game, 'czar', 7)
+        restored = self.journalled_game()
+        restored.resume()
+        self.assertEqual('inactive', restored.status)
+        self.assertEqual([], restored.players)
+
+    def test_only_changes_are_journalled(self):
+        game = self.start_journalled_game()
+        size = os.path.getsize(game.journal.filename)
+        run_command(game, 'help', user=game.players[0])
+        run_command(game, 'score', user=game.players[0])
+        run_command(game, 'winner 0', user=game.players[1])
+        self.assertEqual(size, os.path.getsize(game.journal.filename))
+        pick_answers(game, game.players[1])
+        with open(game.journal.filename) as fp:
+            lines = [json.loads(line) for line in fp]
+        # the deck's card order is written once, not on every line
+        self.assertEqual(1, len([line for line in lines if 'layout' in line]))
+        self.assertLess(os.path.getsize(game.journal.filename) - size, 2000)
+
+    def test_played_cards_are_discarded_after_resume(self):
+        game = self.start_journalled_game()
+        player = game.players[1]
+        pick_answers(game, player)
+        played = [card.id for card in player.deck.dealt_answers]
+        restored = self.journalled_game()
+        restored.resume()
+        self.assertEqual(played, [card.id for card in
+                                  restored.players[1].deck.dealt_answers])
+        pick_answers(restored, restored.players[2])
+        run_command(restored, 'winner 0', user=restored.players[0])
+        for cardid in played:
+            self.assertIn(cardid, restored.deck.answers.discards)
+
+    def test_other_pool_is_not_resumed(self):
+        game = self.start_journalled_game()
+        state = game.journal.latest()
+        state['pool'] = 'something else'
+        restored = self.journalled_game()
+        self.assertFalse(snapshot.restore(restored, state,
+                                          restored.card_pool()))
+        self.assertEqual('inactive', restored.status)
+
+
+class TimerWheelTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.wheel = timers.TimerWheel(1, slots=8, clock=lambda: self.now)
+        self.fired = []
+
+    def test_timer_fires_when_due(self):
+        self.wheel.schedule(3, self.fired.append, 'a')
+        self.now = 2
+        self.wheel.advance()
+        self.assertEqual([], self.fired)
+        self.now = 3
+        self.wheel.advance()
+        self.assertEqual(['a'], self.fired)
+        self.assertEqual(0, len(self.wheel))
+
+    def test_timer_past_one_turn_waits(self):
+        self.wheel.schedule(10, self.fired.append, 'late')
+        self.wheel.schedule(2, self.fired.append, 'early')
+        self.now = 2
+        self.wheel.advance()
+        self.assertEqual(['early'], self.fired)
+        self.now = 9
+        self.wheel.advance()
+        self.assertEqual(['early'], self.fired)
+        self.now = 10
+        self.wheel.advance()
+        self.assertEqual(['early', 'late'], self.fired)
+
+    def test_cancelled_timer_does_not_fire(self):
+        timer = self.wheel.schedule(1, self.fired.append, 'a')
+        timer.cancel()
+        self.now = 5
+        self.wheel.advance()
+        self.assertEqual([], self.fired)
+        self.assertEqual(0, len(self.wheel))
+
+
+class DeadlineTest(unittest.TestCase):
+    def setUp(self):
+        self.game = start_game()
+        self.bob, self.joe, self.jim = self.game.players
+
+    def test_rounds_have_a_deadline(self):
+        self.assertIsNotNone(self.game.deadline)
+        pick_answers(self.game, self.joe)
+        pick_answers(self.game, self.jim)
+        self.assertEqual('wait_czar', self.game.status)
+        self.assertIsNotNone(self.game.deadline)
+
+    def test_deadline_fires_from_wheel(self):
+        now = [0]
+        wheel = timers.TimerWheel(1, clock=lambda: now[0])
+        self.game.irc.timers = wheel
+        self.game.config['answer_timeout'] = 30
+        self.game.set_deadline('answer_timeout', self.game.answers_expired)
+        pick_answers(self.game, self.joe)
+        now[0] = 30
+        wheel.advance()
+        self.assertEqual('wait_czar', self.game.status)
+        self.assertEqual(1, self.jim.idle)
+
+    def test_late_answers_go_to_czar(self):
+        pick_answers(self.game, self.joe)
+        self.game.answers_expired()
+        self.assertEqual('wait_czar', self.game.status)
+        self.assertEqual([self.joe], list(self.game.answers))
+        self.assertEqual(0, self.joe.idle)
+        self.assertEqual(1, self.jim.idle)
+
+    def test_round_with_no_answers_is_skipped(self):
+        round_num = self.game.round_num
+        self.game.answers_expired()
+        self.assertEqual('wait_answers', self.game.status)
+        self.assertEqual(round_num + 1, self.game.round_num)
+        self.assertIs(self.joe, self.game.czar)
+
+    def test_idle_player_is_evicted(self):
+        dan = Player('Dan', '~danno')
+        self.game.add_player(dan)
+        self.game.config['max_idle'] = 2
+        pick_answers(self.game, self.joe)
+        pick_answers(self.game, self.jim)
+        self.game.answers_expired()
+        self.assertIn(dan, self.game.players)
+        self.game.czar_expired()
+        # joe is czar now; dan misses a second deadline
+        pick_answers(self.game, self.bob)
+        pick_answers(self.game, self.jim)
+        self.game.answers_expired()
+        self.assertNotIn(dan, self.game.players)
+        self.assertIsNone(self.game.get_player('Dan'))
+
+    def test_czar_timeout_rotates_czar(self):
+        pick_answers(self.game, self.joe)
+        pick_answers(self.game, self.jim)
+        round_num = self.game.round_num
+        self.game.czar_expired()
+        self.assertIs(self.joe, self.game.czar)
+        self.assertEqual(round_num + 1, self.game.round_num)
+        self.assertEqual(0, sum(p.points for p in self.game.players))
+        self.assertEqual(1, self.bob.idle)
+
+    def test_expired_deadline_after_phase_change_is_ignored(self):
+        pick_answers(self.game, self.joe)
+        pick_answers(self.game, self.jim)
+        self.game.answers_expired()
+        self.assertEqual(0, self.jim.idle)
+        self.assertEqual('wait_czar', self.game.status)
+
+    def test_game_ends_when_too_few_remain(self):
+        self.game.config['max_idle'] = 1
+        self.game.answers_expired()
+        self.assertEqual('inactive', self.game.status)
+        self.assertIsNone(self.game.deadline)
+
+
+class HeadlessTest(unittest.TestCase):
+    def test_headless_game_keeps_lines(self):
+        bot = HeadlessIRC()
+        game = Game('#sim', bot)
+        game.start()
+        self.assertEqual(('#sim', game.render('round_start')), bot.sent[0])
+        self.assertEqual(len(bot.sent), bot.lines)
+
+    def test_simulation_plays_whole_games(self):
+        sim = benchmark.Simulation(games=3, players=3, seed=1).run()
+        self.assertEqual(3, len(sim.latency['start']))
+        self.assertEqual(sim.rounds, len(sim.latency['winner']))
+        self.assertIsNone(sim.bot.sent)
+        self.assertGreater(sim.bot.lines, 0)
+
+
+class HandDisplayTest(unittest.TestCase):
+    def setUp(self):
+        self.template = templates.Template('Your cards are: {cards}',
+                                           'player_hand')
+        self.player = Player('Bob', '~bobbo')
+        for i in range(3):
+            self.player.add_card(Card('Answer', 'Card {}'.format(i)))
+
+    def test_hand_is_one_line(self):
+        self.assertEqual(['Your cards are: [0] Card 0 [1] Card 1 [2] Card 2 '],
+                         self.player.hand_lines(self.template, 400))
+
+    def test_hand_is_cached_until_it_changes(self):
+        lines = self.player.hand_lines(self.template, 400)
+        self.assertIs(lines, self.player.hand_lines(self.template, 400))
+        self.player.deal(0)
+        self.assertEqual(['Your cards are: [0] Card 1 [1] Card 2 '],
+                         self.player.hand_lines(self.template, 400))
+
+    def test_unchanged_slots_are_reused(self):
+        first = self.player.hand_slots()
+        self.player.add_card(Card('Answer', 'Card 3'))
+        second = self.player.hand_slots()
+        for old, new in zip(first, second):
+            self.assertIs(old, new)
+        self.assertEqual('[3] Card 3 ', second[3])
+
+    def test_long_hand_is_split(self):
+        lines = self.player.hand_lines(self.template, 30)
+        self.assertEqual(['Your cards are: [0] Card 0 ',
+                          '[1] Card 1 [2] Card 2 '], lines)
+        for line in lines:
+            self.assertLessEqual(len(line.encode('utf-8')), 30)
+
+    def test_split_text(self):
+        self.assertEqual(['ab', 'cd', 'e'],
+                         sendqueue.split_text(['a', 'b', 'cd', 'e'], 2))
+        self.assertEqual(['a', 'bc'],
+                         sendqueue.split_text(['a', 'b', 'c'], 2, first=1))
+
+
+class DrawTest(unittest.TestCase):
+    def test_draw_question_deals_extra_cards(self):
+        game = Game()
+        game.start()
+        answers = [Card('Answer', 'Card {}'.format(i)) for i in range(50)]
+        question = Card('Question', '%s then %s', 2, 1)
+        game.deck = Deck(answers + [question])
+        for nick in ('Bob', 'Joe', 'Jim'):
+            game.add_player(Player(nick, '~' + nick))
+        self.assertIs(question, game.question)
+        for player in game.players:
+            draw = 0 if player is game.czar else 1
+            self.assertEqual(10 + draw, len(player.deck))
+        game.add_player(Player('Ann', '~ann'))
+        self.assertEqual(11, len(game.players[3].deck))
+
+    def test_unkept_cards_are_not_read(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'cards.json')
+            with open(filename, 'w') as fp:
+                json.dump([{'type': 'Answer', 'value': 'Kept', 'pick': 1,
+                            'draw': 0, 'source': 'Test', 'keep': 'Yes'},
+                           {'type': 'Answer', 'value': 'Dropped', 'pick': 1,
+                            'draw': 0, 'source': 'Test', 'keep': 'No'}], fp)
+            deck = Deck()
+            deck.read_in(filename)
+        self.assertEqual(['Kept'], deck.show_hand('Answer'))
+
+
+class RecycleTest(unittest.TestCase):
+    def test_plain_deck_out_of_answers(self):
+        deck = Deck([Card('Answer', 'Only')])
+        deck.deal('Answer')
+        with self.assertRaises(NoMoreCards):
+            deck.deal('Answer')
+
+    def test_plain_deck_recycles(self):
+        card = Card('Answer', 'Only')
+        deck = Deck([card])
+        deck.deal('Answer')
+        deck.discard(card)
+        self.assertEqual(1, deck.recycle('Answer'))
+        self.assertIs(card, deck.deal('Answer'))
+
+    def test_plain_deck_recycles_double_discard_once(self):
+        cards = [Card('Answer', 'Card 0'), Card('Answer', 'Card 1')]
+        deck = Deck(cards)
+        played = deck.deal('Answer')
+        held = deck.deal('Answer')
+        deck.discard(played)
+        deck.discard(played)
+        self.assertEqual(1, deck.recycle('Answer'))
+        self.assertEqual([played], deck.answercards)
+        self.assertEqual([held], deck.dealt_answers)
+
+    def test_empty_recycle_is_not_counted(self):
+        metrics.enable()
+        try:
+            deck = PoolDeck(cardpool.CardPool([Card('Answer', 'Card 0')]))
+            self.assertEqual(0, deck.recycle('Answer'))
+            self.assertNotIn('Answer', metrics.RECYCLES.values)
+        finally:
+            metrics.enable(False)
+            metrics.reset()
+
+    def test_pool_deck_recycles_when_empty(self):
+        pool = cardpool.CardPool([Card('Answer', 'Card 0'),
+                                  Card('Answer', 'Card 1')])
+        deck = PoolDeck(pool)
+        played = deck.deal('Answer')
+        held = deck.deal('Answer')
+        deck.discard(played)
+        self.assertIs(played, deck.deal('Answer'))
+        with self.assertRaises(NoMoreCards):
+            deck.deal('Answer')
+        self.assertEqual(sorted([played.id, held.id]),
+                         sorted(deck.dealt_answerids))
+
+    def test_round_discards_played_cards(self):
+        game = start_game()
+        question = game.question
+        pick_answers(game, game.players[1])
+        pick_answers(game, game.players[2])
+        played = [card.id for player in game.players[1:]
+                  for card in player.deck.dealt_answers]
+        run_command(game, 'winner 0', user=game.players[0])
+        self.assertEqual(sorted(played), sorted(game.deck.answers.discards))
+        self.assertEqual([question.id], list(game.deck.questions.discards))
+        self.assertEqual([], game.players[1].deck.dealt_answers)
+
+    def test_long_game_never_runs_dry(self):
+        metrics.reset()
+        metrics.enable()
+        try:
+            bot = HeadlessIRC(keep=False)
+            game = Game('#long', bot)
+            game.config['max_points'] = 1000
+            run_command(game, 'start 3rd', user='Bob!~bobbo@127.0.0.1')
+            for nick in ['Joe', 'Jim', 'Ann']:
+                run_command(game, 'join', user=nick + '!~x@127.0.0.1')
+            for i in range(50):
+                for player in game.players:
+                    if player is not game.czar:
+                        pick_answers(game, player)
+                run_command(game, 'winner 0', user=game.czar)
+            self.assertEqual('wait_answers', game.status)
+            self.assertGreater(metrics.RECYCLES.values['Answer'], 0)
+            self.assertGreater(metrics.RECYCLES.values['Question'], 0)
+        finally:
+            metrics.enable(False)
+            metrics.reset()
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+        metrics.enable()
+
+    def tearDown(self):
+        metrics.enable(False)
+        metrics.reset()
+
+    def test_nothing_recorded_when_disabled(self):
+        metrics.enable(False)
+        game = start_game()
+        run_command(game, 'score', user=game.players[0])
+        self.assertEqual({}, metrics.COMMANDS.values)
+        self.assertIsNone(metrics.start())
+
+    def test_commands_and_phases_are_timed(self):
+        game = start_game()
+        pick_answers(game, game.players[1])
+        pick_answers(game, game.players[2])
+        self.assertEqual(2, sum(metrics.COMMANDS.values['play'].counts))
+        self.assertEqual(1, sum(metrics.PHASES.values['wait_answers'].counts))
+
+    def test_messages_are_counted(self):
+        game = Game()
+        receive_msg(game, FakeIRCmsg('hello there'))
+        receive_msg(game, FakeIRCmsg('start'))
+        self.assertEqual(2, metrics.MESSAGES_IN.values[None])
+        self.assertEqual(1, metrics.PARSE_REJECTS.values[None])
+
+    def test_timed_keeps_return_value(self):
+        @metrics.timed
+        def answer():
+            return 42
+        self.assertEqual(42, answer())
+        self.assertEqual(1, sum(metrics.CALLS.values[
+            answer.__qualname__].counts))
+
+    def test_histogram_renders_cumulative_buckets(self):
+        metrics.COMMANDS.observe(0.003, 'play')
+        metrics.COMMANDS.observe(20, 'play')
+        text = metrics.render()
+        self.assertIn('cah_command_seconds_bucket{command="play",le="0.0025"}'
+                      ' 0\n', text)
+        self.assertIn('cah_command_seconds_bucket{command="play",le="0.005"}'
+                      ' 1\n', text)
+        self.assertIn('cah_command_seconds_bucket{command="play",le="+Inf"}'
+                      ' 2\n', text)
+        self.assertIn('cah_command_seconds_count{command="play"} 2\n', text)
+
+    def test_metrics_are_served(self):
+        metrics.MESSAGES_OUT.inc(amount=3)
+        server = metrics.serve(0)
+        try:
+            url = 'http://127.0.0.1:{}/metrics'.format(server.server_port)
+            with urllib.request.urlopen(url) as response:
+                body = response.read().decode('utf-8')
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertIn('cah_messages_out_total 3\n', body)
+
+
+class AsyncLogTest(unittest.TestCase):
+    def setUp(self):
+        self.queue = queue.Queue(4)
+        self.handler = asynclog.DroppingQueueHandler(self.queue,
+                                                     sample_rate=2,
+                                                     high_water=0.5)
+        self.logger = logging.getLogger('asynclog.test')
+        self.logger.propagate = False
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    def drain(self):
+        records = []
+        while not self.queue.empty():
+            records.append(self.queue.get_nowait())
+        return records
+
+    def test_records_are_formatted_later(self):
+        self.logger.warning('%s played %s', 'Bob', 3)
+        record = self.drain()[0]
+        self.assertEqual(('Bob', 3), record.args)
+        self.assertEqual('Bob played 3', record.getMessage())
+
+    def test_mutable_args_are_formatted_at_call(self):
+        player = Player('Bob', '~bobbo')
+        self.logger.warning('%s won', player)
+        player.points += 1
+        record = self.drain()[0]
+        self.assertEqual('Bob [0, 0/0] won', record.getMessage())
+
+    def test_backlog_is_sampled_and_counted(self):
+        for i in range(6):
+            self.logger.warning('warning %d', i)
+        self.assertEqual(4, len(self.drain()))
+        self.assertEqual(2, self.handler.dropped)
+        self.logger.info('info')
+        records = self.drain()
+        self.assertEqual('info', records[0].getMessage())
+        self.assertEqual('Dropped 2 log records', records[1].getMessage())
+        self.assertEqual(0, self.handler.dropped)
+
+    def test_info_is_sampled_above_high_water(self):
+        self.logger.warning('one')
+        self.logger.warning('two')
+        for i in range(2):
+            self.logger.info('info %d', i)
+        self.assertEqual(['one', 'two', 'info 1'],
+                         [r.getMessage() for r in self.drain()])
+
+    def test_json_lines(self):
+        record = logging.LogRecord('game', logging.INFO, __file__, 1,
+                                   '%s called %s', ('Bob', 'play'), None)
+        entry = json.loads(asynclog.JsonFormatter().format(record))
+        self.assertEqual('Bob called play', entry['message'])
+        self.assertEqual('INFO', entry['level'])
+
+
 class CardHandlingTest(unittest.TestCase):
     def test_cards_get_dealt_away(self):
         game = start_game()
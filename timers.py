@@ -0,0 +1,72 @@
+# vi: set expandtab ai:
+"""
+a hashed timer wheel for round deadlines.  every game in the process
+shares one wheel, which the IRC transport advances once per tick, so
+scheduling and cancelling a timer are O(1) no matter how many are
+pending.
+"""
+
+import time
+import math
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Timer(object):
+    __slots__ = ('expires', 'callback', 'args', 'cancelled')
+
+    def __init__(self, expires, callback, args):
+        self.expires = expires
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        """ the timer stays in its slot until the wheel next passes it,
+        but won't fire """
+        self.cancelled = True
+
+
+class TimerWheel(object):
+    """ resolution is the length of one tick in seconds; timers fire on
+    the first tick at or after their delay.  timers further off than one
+    turn of the wheel wait in their slot for the right turn. """
+
+    def __init__(self, resolution=1.0, slots=256, clock=time.monotonic):
+        self.resolution = resolution
+        self.clock = clock
+        self.slots = [[] for i in range(slots)]
+        self.start = clock()
+        self.tick = 0 # the last tick processed
+
+    def schedule(self, delay, callback, *args):
+        """ call callback(*args) after delay seconds; returns a Timer """
+        ticks = max(1, math.ceil(delay / self.resolution))
+        timer = Timer(self.tick + ticks, callback, args)
+        self.slots[timer.expires % len(self.slots)].append(timer)
+        return timer
+
+    def advance(self):
+        """ fire every timer due by now.  called by the transport once
+        per resolution seconds; late calls catch up on missed ticks. """
+        now = int((self.clock() - self.start) / self.resolution)
+        while self.tick < now:
+            self.tick += 1
+            slot = self.slots[self.tick % len(self.slots)]
+            if not slot:
+                continue
+            due = [timer for timer in slot if timer.expires <= self.tick]
+            slot[:] = [timer for timer in slot if timer.expires > self.tick]
+            for timer in due:
+                if timer.cancelled:
+                    continue
+                try:
+                    timer.callback(*timer.args)
+                except Exception:
+                    logger.exception('Timer callback {} failed'.format(
+                                     timer.callback))
+
+    def __len__(self):
+        """ the number of pending timers, cancelled ones included """
+        return sum(len(slot) for slot in self.slots)